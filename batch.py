@@ -0,0 +1,323 @@
+"""整个书库的批量处理
+
+从书库根目录开始查找“系列文件夹”（直接包含带编号文件的文件夹），对每个
+文件夹依次执行提取章节信息、统一编号格式、检查缺失集数和同步音频标题中
+选定的操作。文件夹之间互不影响，由 FairScheduler 在有限的线程中并行处理：
+小文件夹优先，大文件夹最多占用 workers - 1 个线程，始终留出一个线程给小
+文件夹，几个特别大的文件夹不会拖住整个书库。
+
+每个文件夹处理完立即向报告文件追加一行 JSON（JSON Lines），中途中断时已
+完成部分的报告仍然完整：
+
+    {"root": "/library", "operations": ["extract", "unify", "missing"], "apply": true}
+    {"folder": "某小说", "files": 120, "renamed": 118, "failed": [], "missing": ["第37集"], ...}
+    {"summary": {"folders": 8000, "renamed": ..., "failed": ..., "missing": ..., "errors": ...}}
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import engine
+import instrument
+import journal
+import rules
+from planstore import PlanStore
+
+OPERATIONS = ('extract', 'unify', 'missing', 'tags')
+
+# 文件数达到该值的文件夹视为大文件夹
+BIG_FOLDER = 500
+
+DEFAULT_JOBS = 4
+
+
+def find_series(root):
+    """逐个产出直接包含带编号文件的文件夹及其带编号文件数 (文件夹, 文件数)"""
+    if not os.path.isdir(root):
+        raise NotADirectoryError(root)
+    pending = [root]
+    while pending:
+        folder = pending.pop()
+        count = 0
+        subdirs = []
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.name.startswith(engine.RESERVED_PREFIX):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif entry.is_file() and engine.parse_episode(entry.name) is not None:
+                        count += 1
+        except OSError:
+            continue
+        if count:
+            yield folder, count
+        pending.extend(sorted(subdirs, reverse=True))
+
+
+def folder_pipeline(operations, width):
+    """选定的改名操作对应的规则流水线，不改名时返回 None"""
+    if 'extract' in operations and 'unify' in operations:
+        return rules.default_pipeline(('extract', ('pad', width)))
+    if 'extract' in operations:
+        return engine.extract_pipeline()
+    if 'unify' in operations:
+        return engine.unify_pipeline(width)
+    return None
+
+
+def process_folder(folder, operations, width=engine.NUMBER_WIDTH, apply=False, cancel=None, force=False):
+    """处理单个系列文件夹，返回报告条目（dict）"""
+    started = time.monotonic()
+    files = engine.list_files(folder)
+    entry = {'files': len(files)}
+
+    # 计划和缺失检查共用一份按集数排序的存储，每个文件只解析一次
+    pipeline = folder_pipeline(operations, width)
+    transform = instrument.wrap('batch.plan', pipeline.transform) if pipeline is not None else lambda name: name
+    plan = PlanStore.from_files(files, transform)
+    sync_tags = 'tags' in operations
+    if not apply:
+        entry['planned'] = len(plan)
+    elif sync_tags:
+        import normalize
+        import tags
+
+        moving = {src for src, _ in plan}
+        unchanged = [
+            name for name in files
+            if name not in moving and os.path.splitext(name)[1].lower() in tags.AUDIO_EXTENSIONS
+        ]
+        result, tag_result = normalize.rename_and_tag(folder, plan, unchanged, cancel=cancel, force=force)
+        entry['renamed'] = result.success_count
+        entry['failed'] = result.failed
+        entry['cancelled'] = result.cancelled
+        entry['tags'] = {
+            'synced': tag_result.success_count,
+            'skipped': tag_result.skipped_count,
+            'failed': tag_result.failed,
+        }
+    elif plan:
+        result = journal.apply_renames(folder, plan, cancel=cancel)
+        entry['renamed'] = result.success_count
+        entry['failed'] = result.failed
+        entry['cancelled'] = result.cancelled
+
+    if 'missing' in operations:
+        # 改名不改变编号，直接使用改名前的文件名检查
+        groups = engine.check_episodes(plan.episode_entries())
+        entry['missing'] = [
+            group.label(start, end) for group in groups for start, end in group.missing
+        ]
+        entry['missing_count'] = sum(group.missing_count for group in groups)
+        entry['duplicates'] = [
+            group.label(number) for group in groups for number in sorted(group.duplicates)
+        ]
+        entry['outliers'] = [filename for group in groups for _, filename in group.outliers]
+
+    entry['elapsed'] = round(time.monotonic() - started, 3)
+    return entry
+
+
+class FairScheduler:
+    """限制并发数的文件夹调度器
+
+    小文件夹按发现顺序优先处理；大文件夹（文件数不少于 big_folder）同时最多
+    处理 workers - 1 个，剩下的线程只处理小文件夹。
+    """
+
+    def __init__(self, workers, big_folder=BIG_FOLDER):
+        self.big_folder = big_folder
+        self.max_big = max(1, workers - 1)
+        self.small = deque()
+        self.big = deque()
+        self.running_big = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def put(self, folder, size):
+        with self.condition:
+            (self.big if size >= self.big_folder else self.small).append((folder, size))
+            self.condition.notify()
+
+    def close(self):
+        """不再有新的文件夹"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def get(self):
+        """取出下一个文件夹 (文件夹, 文件数)，全部处理完时返回 None"""
+        with self.condition:
+            while True:
+                if self.big and self.running_big < self.max_big:
+                    if not self.small or self.running_big == 0:
+                        self.running_big += 1
+                        return self.big.popleft()
+                if self.small:
+                    return self.small.popleft()
+                if self.closed and not self.big:
+                    return None
+                self.condition.wait()
+
+    def done(self, size):
+        """一个文件夹处理完毕"""
+        with self.condition:
+            if size >= self.big_folder:
+                self.running_big -= 1
+                self.condition.notify_all()
+
+
+class BatchResult:
+    """批量处理的汇总"""
+
+    def __init__(self):
+        self.folders = 0
+        self.files = 0
+        self.planned = 0
+        self.renamed = 0
+        self.failed = 0
+        self.missing = 0
+        self.errors = 0
+        self.tags_synced = 0
+        self.cancelled = False
+
+    def add(self, entry):
+        self.folders += 1
+        self.files += entry.get('files', 0)
+        self.planned += entry.get('planned', 0)
+        self.renamed += entry.get('renamed', 0)
+        self.failed += len(entry.get('failed', ())) + len(entry.get('tags', {}).get('failed', ()))
+        self.missing += entry.get('missing_count', 0)
+        self.errors += 'error' in entry
+        self.tags_synced += entry.get('tags', {}).get('synced', 0)
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+class ReportWriter:
+    """逐行写出 JSON Lines 报告，每个文件夹写完立即刷新到磁盘"""
+
+    def __init__(self, path, header):
+        self.file = open(path, 'w', encoding='utf-8')
+        self.lock = threading.Lock()
+        self.write(header)
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def run_batch(root, operations, width=engine.NUMBER_WIDTH, apply=False, jobs=DEFAULT_JOBS,
+              report_path=None, log=None, progress=None, cancel=None, force=False):
+    """处理书库中的所有系列文件夹，返回 BatchResult
+
+    report_path 为 JSON Lines 报告文件；log(文本) 每处理完一个文件夹调用一次；
+    progress(done, None) 与 cancel 的用法同 journal.apply_renames（总数在扫描
+    完成前未知）。
+    """
+    unknown = set(operations) - set(OPERATIONS)
+    if unknown:
+        raise ValueError(f"未知的操作: {', '.join(sorted(unknown))}")
+    if not os.path.isdir(root):
+        raise NotADirectoryError(root)
+    if 'tags' in operations and apply:
+        import tags     # 缺少 mutagen 时在开始前报错
+
+    result = BatchResult()
+    scheduler = FairScheduler(jobs)
+    lock = threading.Lock()
+    report = None
+    if report_path:
+        report = ReportWriter(report_path, {
+            'root': os.path.abspath(root), 'operations': list(operations), 'apply': apply,
+        })
+
+    def worker():
+        while True:
+            item = scheduler.get()
+            if item is None:
+                return
+            folder, size = item
+            try:
+                if cancel is not None and cancel.is_set():
+                    continue
+                try:
+                    entry = process_folder(folder, operations, width, apply, cancel, force)
+                except Exception as e:
+                    entry = {'error': f"{type(e).__name__}: {str(e)}"}
+                entry = {'folder': os.path.relpath(folder, root), **entry}
+                if report is not None:
+                    report.write(entry)
+                with lock:
+                    result.add(entry)
+                    done = result.folders
+                if log is not None:
+                    log(describe(entry))
+                if progress is not None:
+                    progress(done, None)
+            finally:
+                scheduler.done(size)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(max(1, jobs))]
+    for thread in threads:
+        thread.start()
+    try:
+        for folder, size in find_series(root):
+            if cancel is not None and cancel.is_set():
+                break
+            scheduler.put(folder, size)
+    finally:
+        scheduler.close()
+        for thread in threads:
+            thread.join()
+        result.cancelled = cancel is not None and cancel.is_set()
+        if report is not None:
+            report.write({'summary': result.as_dict()})
+            report.close()
+    return result
+
+
+def describe(entry):
+    """单个文件夹的一行摘要"""
+    if 'error' in entry:
+        return f"[{entry['folder']}] ✗ {entry['error']}"
+    parts = [f"{entry['files']} 个文件"]
+    if 'planned' in entry:
+        parts.append(f"待重命名 {entry['planned']} 个")
+    if 'renamed' in entry:
+        parts.append(f"重命名 {entry['renamed']} 个")
+    if entry.get('failed'):
+        parts.append(f"失败 {len(entry['failed'])} 个")
+    if 'tags' in entry:
+        parts.append(f"同步标题 {entry['tags']['synced']} 个")
+    if entry.get('missing_count'):
+        parts.append(f"缺失 {entry['missing_count']} 个")
+    return f"[{entry['folder']}] " + "，".join(parts)
+
+
+def format_batch_summary(result):
+    """批量处理的汇总文本"""
+    lines = [f"共处理 {result.folders} 个文件夹、{result.files} 个文件"]
+    if result.planned:
+        lines.append(f"待重命名 {result.planned} 个（未执行）")
+    if result.renamed or result.failed:
+        lines.append(f"重命名 {result.renamed} 个，失败 {result.failed} 个")
+    if result.tags_synced:
+        lines.append(f"同步标题 {result.tags_synced} 个")
+    if result.missing:
+        lines.append(f"共缺失 {result.missing} 集")
+    if result.errors:
+        lines.append(f"{result.errors} 个文件夹出错")
+    if result.cancelled:
+        lines.append("操作已取消，其余文件夹未处理")
+    return "\n".join(lines)
@@ -0,0 +1,282 @@
+"""性能基准
+
+生成带有杂乱中文文件名的合成有声书文件夹（可选 1k、10k、100k、1M 个文件），
+其中一部分为体积很小但结构有效的 MP3/M4A/FLAC 文件，然后分别计时各阶段：
+目录扫描、生成计划、缺失检查、执行重命名、同步标题。结果写入 JSON，并可与
+保存的基准比较，超出容差时以非零状态退出。
+
+--latency 为每次 rename/stat/scandir 调用加入固定延迟，在本地模拟网络共享，
+配合 --io-workers 测量并发执行的效果。
+
+示例:
+    python bench.py --sizes 1000 10000 --out bench.json
+    python bench.py --sizes 1000 10000 --baseline bench_baseline.json
+    python bench.py --sizes 1000 10000 --out bench_baseline.json   # 更新基准
+    python bench.py --sizes 1000 --latency 5 --io-workers 1        # 模拟 5 毫秒延迟的网络共享
+    python bench.py --sizes 1000 --latency 5 --io-workers 32
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import struct
+import sys
+import tempfile
+import time
+
+import engine
+import fsio
+import journal
+
+# 计时的阶段（按执行顺序）
+STAGES = ("scan", "plan_extract", "plan_unify", "find_missing",
+          "index_cold", "index_warm", "apply_renames", "sync_titles")
+
+TITLES = ("凡人修仙传", "斗破苍穹", "盗墓笔记", "鬼吹灯", "三体", "庆余年", "雪中悍刀行")
+HOSTS = ("有声的紫襟", "周建龙", "牛大宝", "头陀渊", "小桲")
+TEMPLATES = (
+    "【有声小说】{title}_第{num}{kind}_{host}{ext}",
+    "{title} 第{num}{kind} (主播{host}) 高清{ext}",
+    "[{host}]{title}-第{num}{kind}-{tag}{ext}",
+    "第{num}{kind} {title}{ext}",
+    "{title}{tag}第{num}{kind}{ext}",
+)
+TAGS = ("完整版", "无广告", "精品", "VIP", "修复版", "")
+DIGITS = "零一二三四五六七八九"
+
+
+def chinese_number(n):
+    """把 1-9999 的整数写成中文数字（用于生成测试文件名）"""
+    if n == 0:
+        return DIGITS[0]
+    parts = []
+    for unit, value in (("千", 1000), ("百", 100), ("十", 10), ("", 1)):
+        digit, n = divmod(n, value)
+        if digit:
+            parts.append(("" if digit == 1 and unit == "十" and not parts else DIGITS[digit]) + unit)
+        elif parts and n:
+            if parts[-1] != DIGITS[0]:
+                parts.append(DIGITS[0])
+    return "".join(parts)
+
+
+def atom(name, data):
+    """MP4 atom"""
+    return struct.pack('>I', 8 + len(data)) + name + data
+
+
+def write_mp3(path):
+    """几个 MPEG-1 Layer III 帧"""
+    frame = b'\xff\xfb\x90\x64' + b'\x00' * 413
+    with open(path, 'wb') as f:
+        f.write(frame * 8)
+
+
+def write_flac(path):
+    """只有 STREAMINFO 块的 FLAC"""
+    info = struct.pack('>HH', 4096, 4096) + b'\x00' * 6
+    info += ((44100 << 44) | (1 << 41) | (15 << 36) | 44100).to_bytes(8, 'big') + b'\x00' * 16
+    with open(path, 'wb') as f:
+        f.write(b'fLaC' + b'\x80' + len(info).to_bytes(3, 'big') + info + b'\x00' * 64)
+
+
+def write_m4a(path):
+    """只有 ftyp/moov(mvhd)/mdat 的 M4A"""
+    mvhd = atom(b'mvhd', b'\x00' * 12 + struct.pack('>II', 1000, 1000) + b'\x00' * 80)
+    with open(path, 'wb') as f:
+        f.write(atom(b'ftyp', b'M4A \x00\x00\x00\x00M4A mp42isom') + atom(b'moov', mvhd)
+                + atom(b'mdat', b'\x00' * 64))
+
+
+AUDIO_WRITERS = {'.mp3': write_mp3, '.m4a': write_m4a, '.flac': write_flac}
+
+
+def generate_library(folder, count, audio_count, seed=0):
+    """生成 count 个文件，其中 audio_count 个为有效音频文件，其余为空的文本类文件
+
+    约 2% 的编号缺失，约 5% 使用中文数字，保证文件名互不相同。
+    """
+    rng = random.Random(seed)
+    os.makedirs(folder, exist_ok=True)
+    title = rng.choice(TITLES)
+    number = 0
+    for index in range(count):
+        number += 2 if rng.random() < 0.02 else 1
+        num = chinese_number(number) if number < 10000 and rng.random() < 0.05 else str(number)
+        ext = rng.choice(tuple(AUDIO_WRITERS)) if index < audio_count else rng.choice(('.txt', '.lrc', '.nfo'))
+        name = rng.choice(TEMPLATES).format(
+            title=title, num=num, kind=rng.choice("章节集") if rng.random() < 0.1 else "集",
+            host=rng.choice(HOSTS), tag=rng.choice(TAGS), ext=ext
+        )
+        path = os.path.join(folder, f"{index:07d}{name}" if rng.random() < 0.01 else name)
+        if index < audio_count:
+            AUDIO_WRITERS[ext](path)
+        else:
+            open(path, 'wb').close()
+
+
+class LatencyShim:
+    """在 with 范围内为 os 的文件系统调用加入固定延迟（秒），并统计调用次数
+
+    os.path.exists/isfile 等内部使用 os.stat，同样受影响。time.sleep 会释放
+    GIL，与网络等待一样可以被其他线程重叠。
+    """
+
+    FUNCTIONS = ('rename', 'replace', 'stat', 'lstat', 'scandir')
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+        self.originals = {}
+
+    def __enter__(self):
+        for name in self.FUNCTIONS:
+            self.originals[name] = getattr(os, name)
+            setattr(os, name, self.delayed(self.originals[name]))
+        return self
+
+    def __exit__(self, *exc_info):
+        for name, func in self.originals.items():
+            setattr(os, name, func)
+        self.originals.clear()
+
+    def delayed(self, func):
+        def call(*args, **kwargs):
+            self.calls += 1
+            time.sleep(self.latency)
+            return func(*args, **kwargs)
+        return call
+
+
+def timed(func, repeat=1):
+    """运行 repeat 次，返回 (最短耗时秒数, 最后一次的返回值)"""
+    best = None
+    value = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        value = func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, value
+
+
+def run_size(workdir, count, audio_count, repeat, workers, latency=0.0):
+    """对一个规模的合成文件夹依次计时各阶段，latency 大于 0 时模拟网络共享"""
+    folder = os.path.join(workdir, f"lib_{count}")
+    generate_library(folder, count, min(count, audio_count))
+    os.environ['RENAME_CACHE_DIR'] = os.path.join(workdir, "cache")
+
+    if latency > 0:
+        with LatencyShim(latency) as shim:
+            results = time_stages(folder, repeat, workers)
+        print(f"  模拟延迟 {latency * 1000:.1f} ms，共 {shim.calls} 次文件系统调用")
+        return results
+    return time_stages(folder, repeat, workers)
+
+
+def time_stages(folder, repeat, workers):
+    """依次计时各阶段"""
+    results = {}
+    results["scan"], files = timed(lambda: engine.list_files(folder), repeat)
+    results["plan_extract"], plan = timed(lambda: engine.plan_extract(files), repeat)
+    results["plan_unify"], _ = timed(lambda: engine.plan_unify(files), repeat)
+    results["find_missing"], _ = timed(lambda: engine.find_missing(files), repeat)
+
+    from index import FolderIndex
+
+    def refresh_index():
+        with FolderIndex(folder) as folder_index:
+            folder_index.refresh()
+
+    results["index_cold"], _ = timed(refresh_index)
+    results["index_warm"], _ = timed(refresh_index, repeat)
+
+    results["apply_renames"], outcome = timed(lambda: journal.apply_renames(folder, plan))
+    if outcome.failed:
+        print(f"  重命名失败 {len(outcome.failed)} 个（合成文件名中有重复编号）", file=sys.stderr)
+
+    try:
+        import tags
+    except ImportError:
+        print("  未安装mutagen，跳过 sync_titles", file=sys.stderr)
+    else:
+        audio_files = tags.list_audio_files(folder)
+        results["sync_titles"], _ = timed(
+            lambda: tags.sync_audio_titles(folder, audio_files, workers=workers))
+
+    return results
+
+
+def compare(results, baseline, tolerance, min_delta):
+    """与基准比较，返回回退项 [(规模, 阶段, 当前, 基准), ...]"""
+    regressions = []
+    for size, stages in results.items():
+        for stage, seconds in stages.items():
+            reference = baseline.get(size, {}).get(stage)
+            if reference is None:
+                continue
+            if seconds > reference * (1 + tolerance) and seconds - reference > min_delta:
+                regressions.append((size, stage, seconds, reference))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量重命名工具性能基准")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000],
+                        help="文件夹规模，如 1000 10000 100000 1000000")
+    parser.add_argument("--audio", type=int, default=1000, help="每个文件夹中有效音频文件的数量上限")
+    parser.add_argument("--repeat", type=int, default=3, help="纯计算阶段重复次数，取最短耗时")
+    parser.add_argument("--workers", type=int, default=1, help="同步标题的并行进程数")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="每次 rename/stat/scandir 调用的模拟延迟（毫秒），用于模拟网络共享")
+    parser.add_argument("--io-workers", type=int, default=1, help="同时在途的文件系统请求数")
+    parser.add_argument("--workdir", help="生成文件的目录（默认临时目录，结束后删除）")
+    parser.add_argument("--out", help="结果 JSON 文件")
+    parser.add_argument("--baseline", help="基准 JSON 文件，超出容差时返回 1")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="允许比基准慢的比例")
+    parser.add_argument("--min-delta", type=float, default=0.005, help="小于该秒数的差异视为噪声")
+    args = parser.parse_args(argv)
+
+    fsio.set_workers(args.io_workers)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="rename-bench-")
+    results = {}
+    try:
+        for count in args.sizes:
+            print(f"规模 {count}:")
+            results[str(count)] = run_size(
+                workdir, count, args.audio, args.repeat, args.workers, args.latency / 1000)
+            for stage in STAGES:
+                if stage in results[str(count)]:
+                    print(f"  {stage:<14} {results[str(count)][stage] * 1000:10.1f} ms")
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "latency_ms": args.latency,
+        "io_workers": args.io_workers,
+        "results": results,
+    }
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance, args.min_delta)
+        for size, stage, seconds, reference in regressions:
+            print(f"✗ 性能回退: 规模 {size} {stage} {seconds * 1000:.1f} ms"
+                  f"（基准 {reference * 1000:.1f} ms）", file=sys.stderr)
+        if regressions:
+            return 1
+        print("与基准相比没有性能回退")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,571 @@
+"""命令行入口，用于无界面的批量处理
+
+示例:
+    python rename.py extract /path/to/folder            # 仅预览
+    python rename.py extract /path/to/folder --apply    # 执行重命名
+    python rename.py unify /path/a /path/b --apply
+    python rename.py unify /path/to/folder --apply --tags   # 重命名并同步标题
+    python rename.py rules /path/to/folder --config rules.json --apply
+    python rename.py rules /path/to/folder --step normalize --step extract --step pad:3
+    python rename.py extract /path/to/folder --export plan.jsonl   # 导出计划
+    python rename.py import plan.jsonl --apply          # 核对后执行导出的计划
+    python rename.py missing /path/to/folder
+    python rename.py dupes /path/to/folder              # 检查内容相同的重复集数
+    python rename.py undo /path/to/folder               # 撤销最近一次重命名
+    python rename.py watch /path/a /path/b              # 监视新下载的文件
+    python rename.py batch /library --apply --report report.jsonl   # 处理整个书库
+    python rename.py sync-tags /path/to/folder
+    python rename.py audit /path/to/folder              # 列出标题与文件名不一致的音频
+    python rename.py --profile stats.json --trace trace.json sync-tags /path/to/folder
+    python rename.py --io-workers 32 unify //nas/books --apply   # 网络共享上并发执行重命名
+"""
+import argparse
+import os
+import sys
+
+import engine
+import fsio
+import instrument
+import journal
+import planfile
+import rules
+
+# 无界面的重命名和检查路径不应加载的模块
+HEAVY_MODULES = ("mutagen", "tkinter", "sqlite3")
+
+
+def print_plan(folder, plan):
+    """输出重命名计划"""
+    for original, new_name in plan:
+        print(f"{original} → {new_name}")
+    print(f"[{folder}] 共 {len(plan)} 个文件待重命名")
+
+
+def print_result(folder, result, title):
+    """输出操作结果"""
+    summary = f"[{folder}] {title}: 成功 {result.success_count} 个，失败 {len(result.failed)} 个"
+    if result.skipped_count:
+        summary += f"，跳过 {result.skipped_count} 个"
+    if result.rewritten:
+        summary += f"，其中 {len(result.rewritten)} 个需要重写整个文件"
+    print(summary)
+    for detail in result.failed:
+        print(f"  ✗ {detail}", file=sys.stderr)
+
+
+def query_folder(args, folder, query, fallback, quick=True):
+    """通过文件夹索引查询；--no-index 时直接扫描文件夹
+
+    quick 的用法同 FolderIndex.refresh，需要准确的文件大小时使用 quick=False。
+    """
+    if args.no_index:
+        return fallback(engine.iter_files(folder, args.recursive))
+
+    from index import FolderIndex
+
+    with FolderIndex(folder) as folder_index:
+        folder_index.refresh(args.recursive, quick)
+        return query(folder_index)
+
+
+def rename_and_tag(folder, args, fallback):
+    """扫描一次，重命名并同步所有音频文件的标题"""
+    import normalize
+
+    try:
+        import tags
+    except ImportError as e:
+        print(f"音频元数据功能需要安装mutagen库: pip install mutagen ({e})", file=sys.stderr)
+        return 2
+
+    files = list(engine.iter_files(folder, args.recursive))
+    plan = fallback(files)
+    warn_duplicates(folder, plan)
+    moving = {src for src, _ in plan}
+    unchanged = [
+        name for name in files
+        if name not in moving and os.path.splitext(name)[1].lower() in tags.AUDIO_EXTENSIONS
+    ]
+    result, tag_result = normalize.rename_and_tag(folder, plan, unchanged)
+    print_result(folder, result, "重命名")
+    print_result(folder, tag_result, "同步音频标题")
+    return 1 if result.failed or tag_result.failed else 0
+
+
+def export_plan(args, transform):
+    """边扫描边写出计划文件，不在内存中保存整个计划"""
+    if len(args.folders) != 1:
+        print("导出计划时只能指定一个文件夹", file=sys.stderr)
+        return 2
+    folder = args.folders[0]
+    plan = engine.iter_plan(engine.iter_files(folder, args.recursive), transform)
+    count = planfile.write_plan(args.export, folder, plan, op=args.command)
+    print(f"[{folder}] 已导出 {count} 个条目到 {args.export}")
+    return 0
+
+
+def find_duplicates(args, folder, full=True):
+    """检查内容相同的重复集数，返回 duplicates.DuplicateReport"""
+    import duplicates
+
+    # 原地变大的文件不改变目录的修改时间，需要完整核对文件大小
+    entries = query_folder(
+        args, folder,
+        lambda folder_index: folder_index.duplicate_entries(args.recursive),
+        lambda files: duplicates.scan_entries(folder, files),
+        quick=False
+    )
+    return duplicates.find_duplicates(folder, entries, full)
+
+
+def warn_duplicates(folder, plan):
+    """重命名前提示重复的副本（它们的目标文件名相同，只有一个能改名成功）
+
+    只检查计划中目标文件名相同的条目，不再扫描整个文件夹。
+    """
+    import duplicates
+
+    sources = {}
+    for src, dst in plan:
+        sources.setdefault(dst, []).append(src)
+    colliding = [src for names in sources.values() if len(names) > 1 for src in names]
+    if not colliding:
+        return
+    report = duplicates.find_duplicates(folder, duplicates.scan_entries(folder, colliding), full=False)
+    if report.groups:
+        print(f"[{folder}] 发现重复的副本，可先用 dupes 命令确认后删除:", file=sys.stderr)
+        print(duplicates.format_duplicate_report(report), file=sys.stderr)
+
+
+def run_rename(args, query, fallback, transform):
+    """提取章节信息 / 统一编号格式"""
+    if args.export:
+        return export_plan(args, transform)
+
+    exit_code = 0
+    for folder in args.folders:
+        if args.apply and args.tags:
+            exit_code = rename_and_tag(folder, args, fallback) or exit_code
+            continue
+
+        plan = query_folder(args, folder, query, fallback)
+        if not args.apply:
+            print_plan(folder, plan)
+            continue
+
+        warn_duplicates(folder, plan)
+        result = journal.apply_renames(folder, plan)
+        print_result(folder, result, "重命名")
+        if result.failed:
+            exit_code = 1
+    return exit_code
+
+
+def cmd_extract(args):
+    return run_rename(
+        args,
+        lambda folder_index: folder_index.plan_extract(args.recursive),
+        engine.plan_extract,
+        engine.process_filename
+    )
+
+
+def cmd_unify(args):
+    return run_rename(
+        args,
+        lambda folder_index: folder_index.plan_unify(args.recursive, args.width),
+        lambda files: engine.plan_unify(files, args.width),
+        engine.unify_pipeline(args.width).transform
+    )
+
+
+def cmd_rules(args):
+    """按自定义规则和步骤重命名"""
+    pipeline = rules.load_config(args.config, args.step)
+    return run_rename(
+        args,
+        lambda folder_index: engine.plan_rules(folder_index.names(args.recursive), pipeline),
+        lambda files: engine.plan_rules(files, pipeline),
+        pipeline.transform
+    )
+
+
+def cmd_import(args):
+    """预览或执行导出的计划文件"""
+    if args.apply:
+        result = planfile.apply_plan(
+            args.plan, args.folder, check_mtime=not args.ignore_mtime,
+            log=lambda message: print(message, file=sys.stderr)
+        )
+        print_result(args.folder or args.plan, result, "执行计划")
+        return 1 if result.failed else 0
+
+    header, entries = planfile.read_plan(args.plan)
+    folder = args.folder or header['folder']
+    valid = stale = 0
+    try:
+        for entry in entries:
+            reason = planfile.check_entry(folder, entry, not args.ignore_mtime)
+            if reason is None:
+                valid += 1
+                print(f"{entry['source']} → {entry['target']}")
+            else:
+                stale += 1
+                print(f"{entry['source']} → {entry['target']} (已过期: {reason})")
+    finally:
+        entries.close()
+    print(f"[{folder}] 计划 {header.get('op')}: {valid} 个有效，{stale} 个已过期")
+    return 0
+
+
+def cmd_recover(args):
+    """继续执行或回滚中断的重命名"""
+    exit_code = 0
+    for folder in args.folders:
+        if not journal.pending_journal(folder):
+            print(f"[{folder}] 没有未完成的重命名")
+            continue
+
+        if args.rollback:
+            result = journal.rollback(folder)
+            print_result(folder, result, "回滚")
+        else:
+            result = journal.resume(folder)
+            print_result(folder, result, "继续重命名")
+        if result.failed:
+            exit_code = 1
+    return exit_code
+
+
+def cmd_undo(args):
+    """撤销最近一次重命名"""
+    exit_code = 0
+    for folder in args.folders:
+        result = journal.undo(folder)
+        print_result(folder, result, "撤销重命名")
+        if result.failed:
+            exit_code = 1
+    return exit_code
+
+
+def cmd_watch(args):
+    """监视文件夹，自动处理新文件"""
+    import watch
+
+    try:
+        watch.watch(
+            args.folders, settle=args.settle, poll=args.poll, interval=args.interval,
+            width=args.width, sync_tags=not args.no_tags
+        )
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def parse_importtime(output):
+    """解析 -X importtime 输出，返回 [(模块, 自身微秒, 累计微秒, 层级), ...]"""
+    records = []
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        name_field = fields[2][1:]
+        level = (len(name_field) - len(name_field.lstrip())) // 2
+        records.append((name_field.strip(), int(fields[0]), int(fields[1]), level))
+    return records
+
+
+def cmd_startup(args):
+    """测量启动耗时，列出最耗时的导入，并检查无需加载的重量级模块"""
+    import subprocess
+    import time
+
+    if getattr(sys, 'frozen', False):
+        print("打包后的EXE不支持 -X importtime，请用脚本运行", file=sys.stderr)
+        return 2
+
+    command = args.command[1:] if args.command[:1] == ["--"] else args.command
+    command = command or ["missing", "--no-index", "."]
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "rename.py")
+
+    started = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", script, *command],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+    )
+    elapsed = time.perf_counter() - started
+
+    records = parse_importtime(completed.stderr)
+    total_import = sum(cumulative for _, _, cumulative, level in records if level == 0)
+    print(f"命令: {' '.join(command)}")
+    print(f"总耗时: {elapsed * 1000:.1f} ms（其中导入 {total_import / 1000:.1f} ms）")
+    print(f"\n最耗时的导入（累计 ms / 自身 ms）:")
+    for name, self_us, cumulative, level in sorted(records, key=lambda r: r[2], reverse=True)[:args.top]:
+        print(f"  {cumulative / 1000:8.1f} {self_us / 1000:8.1f}  {'  ' * level}{name}")
+
+    # 只有涉及音频标题的命令需要 mutagen，命令行模式不应加载图形界面
+    loaded = {name.split(".")[0] for name, _, _, _ in records}
+    unexpected = set(HEAVY_MODULES) & loaded
+    if command[0] in ("sync-tags", "watch", "audit") or "--tags" in command:
+        unexpected.discard("mutagen")
+    if "--no-index" not in command:
+        unexpected.discard("sqlite3")
+    if unexpected:
+        print(f"\n✗ 加载了不需要的模块: {', '.join(sorted(unexpected))}")
+        return 1
+    return 0
+
+
+def cmd_missing(args):
+    """检查缺失集数"""
+    exit_code = 0
+    for folder in args.folders:
+        report = query_folder(
+            args, folder,
+            lambda folder_index: folder_index.find_missing(args.recursive),
+            engine.find_missing
+        )
+        if not report:
+            print(f"[{folder}] 没有找到带编号的文件")
+            continue
+
+        print(f"[{folder}]")
+        print(engine.format_episode_report(report))
+        if not all(group.complete for group in report):
+            exit_code = 1
+    return exit_code
+
+
+def cmd_dupes(args):
+    """检查内容相同的重复集数，列出建议保留的副本"""
+    import duplicates
+
+    exit_code = 0
+    for folder in args.folders:
+        report = find_duplicates(args, folder, full=not args.quick)
+        print(f"[{folder}]")
+        print(duplicates.format_duplicate_report(report))
+        if report.groups:
+            exit_code = 1
+    return exit_code
+
+
+def cmd_batch(args):
+    """批量处理书库中的所有系列文件夹"""
+    import batch
+
+    operations = [name.strip() for name in args.ops.split(",") if name.strip()]
+    unknown = set(operations) - set(batch.OPERATIONS)
+    if unknown:
+        print(f"未知的操作: {', '.join(sorted(unknown))}（可用: {', '.join(batch.OPERATIONS)}）",
+              file=sys.stderr)
+        return 2
+    try:
+        result = batch.run_batch(
+            args.root, operations, args.width, args.apply, args.jobs, args.report,
+            log=print, force=args.force
+        )
+    except ImportError as e:
+        print(f"音频元数据功能需要安装mutagen库: pip install mutagen ({e})", file=sys.stderr)
+        return 2
+
+    print(batch.format_batch_summary(result))
+    if args.report:
+        print(f"报告已保存到 {args.report}")
+    return 1 if result.failed or result.errors else 0
+
+
+def cmd_sync_tags(args):
+    """同步音频标题"""
+    try:
+        import tags
+    except ImportError as e:
+        print(f"音频元数据功能需要安装mutagen库: pip install mutagen ({e})", file=sys.stderr)
+        return 2
+
+    exit_code = 0
+    for folder in args.folders:
+        audio_files = tags.iter_audio_files(folder, args.recursive)
+        if args.no_index:
+            result = tags.sync_audio_titles(folder, audio_files, workers=args.workers, force=args.force)
+        else:
+            from index import FolderIndex
+
+            with FolderIndex(folder) as folder_index:
+                folder_index.refresh(args.recursive, quick=False)
+                result = tags.sync_audio_titles(
+                    folder, audio_files, workers=args.workers, force=args.force, index=folder_index
+                )
+        print_result(folder, result, "同步音频标题")
+        if result.failed:
+            exit_code = 1
+    return exit_code
+
+
+def cmd_audit(args):
+    """列出标题与文件名不一致的音频文件（只读）"""
+    import tagscan
+
+    try:
+        import tags
+        fallback = tags.read_tags
+        extensions = tags.AUDIO_EXTENSIONS
+    except ImportError:
+        # 快速扫描不依赖 mutagen，只是少数特殊写法无法读取
+        fallback = None
+        extensions = set(tagscan.SCANNERS)
+
+    exit_code = 0
+    for folder in args.folders:
+        counts = {}
+        for filename, status, detail in tagscan.audit(
+                folder, engine.iter_files(folder, args.recursive, extensions), fallback):
+            counts[status] = counts.get(status, 0) + 1
+            if status == tagscan.OUT_OF_SYNC:
+                print(f"{filename}: 当前标题 {detail or '(空)'}")
+            elif status == tagscan.UNTAGGED:
+                print(f"{filename}: 没有标签")
+            elif status == tagscan.UNREADABLE:
+                print(f"{filename}: 无法读取 ({detail})", file=sys.stderr)
+
+        print(f"[{folder}] 一致 {counts.get(tagscan.IN_SYNC, 0)} 个，"
+              f"不一致 {counts.get(tagscan.OUT_OF_SYNC, 0)} 个，"
+              f"没有标签 {counts.get(tagscan.UNTAGGED, 0)} 个，"
+              f"无法读取 {counts.get(tagscan.UNREADABLE, 0)} 个")
+        if any(status != tagscan.IN_SYNC for status in counts):
+            exit_code = 1
+    return exit_code
+
+
+def build_parser():
+    """构建命令行参数解析器"""
+    parser = argparse.ArgumentParser(prog="rename", description="批量文件重命名工具")
+    parser.add_argument("--profile", metavar="FILE", help="记录各阶段耗时，输出汇总并保存为 JSON")
+    parser.add_argument("--trace", metavar="FILE", help="记录各阶段耗时并保存为 Chrome trace 文件")
+    parser.add_argument("--io-workers", type=int, metavar="N",
+                        help="同时在途的文件系统请求数，用于高延迟的网络共享（默认1，可用 RENAME_IO_WORKERS 设置）")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    extract = subparsers.add_parser("extract", help="提取章节信息")
+    extract.set_defaults(func=cmd_extract)
+
+    unify = subparsers.add_parser("unify", help="统一编号格式")
+    unify.add_argument("--width", type=int, default=engine.NUMBER_WIDTH, help="编号位数")
+    unify.set_defaults(func=cmd_unify)
+
+    custom = subparsers.add_parser("rules", help="按自定义规则重命名")
+    custom.add_argument("--config", help="JSON 规则配置（patterns 识别规则、steps 步骤）")
+    custom.add_argument("--step", action="append",
+                        help="重命名步骤，可重复: extract、normalize、pad:位数、prefix:文本、suffix:文本")
+    custom.set_defaults(func=cmd_rules)
+
+    for sub in (extract, unify, custom):
+        sub.add_argument("--apply", action="store_true", help="执行重命名（默认仅预览）")
+        sub.add_argument("--export", metavar="FILE", help="把计划导出为 JSON Lines 文件，稍后用 import 执行")
+        sub.add_argument("--tags", action="store_true",
+                         help="与 --apply 一起使用：同时把音频标题设为新文件名（只扫描一次）")
+
+    missing = subparsers.add_parser("missing", help="检查缺失集数")
+    missing.set_defaults(func=cmd_missing)
+
+    dupes = subparsers.add_parser("dupes", help="检查内容相同的重复集数")
+    dupes.add_argument("--quick", action="store_true", help="只比较开头和结尾，不计算完整哈希")
+    dupes.set_defaults(func=cmd_dupes)
+
+    sync = subparsers.add_parser("sync-tags", help="同步音频标题")
+    sync.add_argument("-j", "--workers", type=int, default=1, help="并行进程数（默认1，即不并行）")
+    sync.add_argument("--force", action="store_true", help="标题已一致的文件也重写")
+    sync.set_defaults(func=cmd_sync_tags)
+
+    audit = subparsers.add_parser("audit", help="列出标题与文件名不一致的音频（只读取标签头）")
+    audit.add_argument("folders", nargs="+", help="目标文件夹")
+    audit.add_argument("-r", "--recursive", action="store_true", help="包含子文件夹")
+    audit.set_defaults(func=cmd_audit)
+
+    startup = subparsers.add_parser("startup", help="测量启动耗时（-X importtime）")
+    startup.add_argument("--top", type=int, default=15, help="显示最耗时的前几个导入")
+    startup.add_argument("command", nargs=argparse.REMAINDER, help="要测量的命令，默认 missing --no-index .")
+    startup.set_defaults(func=cmd_startup)
+
+    for sub in (extract, unify, custom, missing, dupes, sync):
+        sub.add_argument("folders", nargs="+", help="目标文件夹")
+        sub.add_argument("-r", "--recursive", action="store_true", help="包含子文件夹")
+        sub.add_argument("--no-index", action="store_true", help="不使用文件夹索引，每次完整扫描")
+
+    plan_import = subparsers.add_parser("import", help="预览或执行导出的计划文件")
+    plan_import.add_argument("plan", help="计划文件（JSON Lines）")
+    plan_import.add_argument("--folder", help="目标文件夹（默认使用计划中记录的文件夹）")
+    plan_import.add_argument("--apply", action="store_true", help="执行计划（默认仅预览）")
+    plan_import.add_argument("--ignore-mtime", action="store_true",
+                             help="只核对文件大小（文件复制到其他机器后修改时间可能变化）")
+    plan_import.set_defaults(func=cmd_import)
+
+    library = subparsers.add_parser("batch", help="批量处理书库中的所有系列文件夹")
+    library.add_argument("root", help="书库根目录，其中直接包含带编号文件的文件夹都会处理")
+    library.add_argument("--ops", default="extract,unify,missing",
+                         help="逗号分隔的操作: extract, unify, missing, tags（默认 extract,unify,missing）")
+    library.add_argument("--apply", action="store_true", help="执行重命名和标题同步（默认仅统计）")
+    library.add_argument("-j", "--jobs", type=int, default=4, help="同时处理的文件夹数（默认4）")
+    library.add_argument("--width", type=int, default=engine.NUMBER_WIDTH, help="编号位数")
+    library.add_argument("--report", metavar="FILE", help="逐个文件夹写出 JSON Lines 报告")
+    library.add_argument("--force", action="store_true", help="标题已一致的文件也重写")
+    library.set_defaults(func=cmd_batch)
+
+    recover = subparsers.add_parser("recover", help="继续执行或回滚中断的重命名")
+    recover.add_argument("folders", nargs="+", help="目标文件夹")
+    recover.add_argument("--rollback", action="store_true", help="回滚而不是继续执行")
+    recover.set_defaults(func=cmd_recover)
+
+    undo = subparsers.add_parser("undo", help="撤销最近一次重命名")
+    undo.add_argument("folders", nargs="+", help="目标文件夹")
+    undo.set_defaults(func=cmd_undo)
+
+    watch = subparsers.add_parser("watch", help="监视文件夹，自动重命名并同步新文件的标题")
+    watch.add_argument("folders", nargs="+", help="目标文件夹")
+    watch.add_argument("--settle", type=float, default=5.0, help="文件多少秒不再变化视为下载完成")
+    watch.add_argument("--poll", action="store_true", help="使用定时扫描而不是 inotify")
+    watch.add_argument("--interval", type=float, default=2.0, help="定时扫描的间隔秒数")
+    watch.add_argument("--width", type=int, default=engine.NUMBER_WIDTH, help="编号位数")
+    watch.add_argument("--no-tags", action="store_true", help="不同步音频标题")
+    watch.set_defaults(func=cmd_watch)
+
+    return parser
+
+
+def report_profile(args, env_path):
+    """输出并保存耗时统计"""
+    print("\n耗时统计:\n" + instrument.format_summary(), file=sys.stderr)
+    for path, export in ((args.profile or env_path, instrument.export_summary),
+                         (args.trace, instrument.export_trace)):
+        if path:
+            try:
+                export(path)
+            except OSError as e:
+                print(f"保存耗时统计失败: {e}", file=sys.stderr)
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    env_path = instrument.enable_from_env()
+    if args.profile or args.trace:
+        instrument.enable()
+    fsio.workers_from_env()
+    if args.io_workers:
+        fsio.set_workers(args.io_workers)
+    try:
+        return args.func(args)
+    except NotADirectoryError as e:
+        print(f"无效文件夹: {e}", file=sys.stderr)
+        return 2
+    except (journal.JournalError, rules.RuleError, planfile.PlanError) as e:
+        print(str(e), file=sys.stderr)
+        return 2
+    finally:
+        if instrument.enabled:
+            report_profile(args, env_path)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
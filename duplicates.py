@@ -0,0 +1,206 @@
+"""重复集数检测
+
+同一集常以不同的杂乱文件名下载两次，提取章节信息后两者的目标文件名相同，
+重命名时只能报告“目标文件已存在”。这里在重命名之前找出内容相同的副本：
+
+1. 按文件夹、章/节/集、编号和文件大小分组，只有多于一个文件的组才读取内容；
+2. 用 mmap 读取开头和结尾各 BLOCK_SIZE 字节计算部分哈希，不同的直接排除；
+   文件不超过两个块时部分哈希已覆盖全文；
+3. 部分哈希相同但未覆盖全文时，再计算完整哈希确认（full=False 时跳过）。
+
+不重复的文件绝大多数在第 1 步就被排除，整个库实际读取的字节数很少。
+"""
+import hashlib
+import mmap
+import os
+
+import engine
+import instrument
+
+# 部分哈希读取的开头/结尾块大小
+BLOCK_SIZE = 64 * 1024
+
+# 完整哈希每次读取的大小
+READ_SIZE = 1 << 20
+
+
+class DuplicateGroup:
+    """内容相同的一组文件，files[0] 为建议保留的副本
+
+    verified 为真表示已比较全部内容（完整哈希或文件小于两个块），
+    否则只比较了开头和结尾。
+    """
+
+    def __init__(self, kind, number, size, files, verified):
+        self.kind = kind
+        self.number = number
+        self.size = size
+        self.files = files
+        self.verified = verified
+
+    @property
+    def folder(self):
+        return os.path.dirname(self.files[0])
+
+    @property
+    def keep(self):
+        return self.files[0]
+
+    @property
+    def remove(self):
+        return self.files[1:]
+
+
+class DuplicateReport:
+    """检测结果：groups 为 DuplicateGroup 列表，另记录读取量用于说明开销"""
+
+    def __init__(self):
+        self.groups = []
+        self.candidate_count = 0    # 编号和大小都相同、需要读取内容的文件数
+        self.candidate_bytes = 0
+        self.bytes_read = 0
+        self.cancelled = False
+
+    @property
+    def wasted_bytes(self):
+        """删除多余副本可释放的空间"""
+        return sum(group.size * len(group.remove) for group in self.groups)
+
+
+def scan_entries(folder, files):
+    """为带编号的文件生成 (文件名, 章/节/集, 编号, 大小)，不使用索引时使用"""
+    for filename in files:
+        episode = engine.parse_episode(filename)
+        if episode is None:
+            continue
+        try:
+            size = os.stat(os.path.join(folder, filename)).st_size
+        except OSError:
+            continue
+        yield filename, episode[0], episode[1], size
+
+
+def group_candidates(entries):
+    """按 (文件夹, 章/节/集, 编号, 大小) 分组，只返回多于一个文件的组"""
+    groups = {}
+    for filename, kind, number, size in entries:
+        key = (os.path.dirname(filename), kind, number, size)
+        groups.setdefault(key, []).append(filename)
+    return [(key, names) for key, names in sorted(groups.items()) if len(names) > 1]
+
+
+def covers_whole(size):
+    """部分哈希是否已覆盖全部内容"""
+    return size <= 2 * BLOCK_SIZE
+
+
+def partial_hash(filepath):
+    """开头和结尾各 BLOCK_SIZE 字节的哈希，返回 ((大小, 哈希), 读取字节数)
+
+    大小取自打开后的 fstat，而不是索引中可能已过期的值。
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(filepath, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return (size, digest.digest()), 0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if covers_whole(size):
+                digest.update(data)
+                return (size, digest.digest()), size
+            digest.update(data[:BLOCK_SIZE])
+            digest.update(data[-BLOCK_SIZE:])
+    return (size, digest.digest()), 2 * BLOCK_SIZE
+
+
+def full_hash(filepath):
+    """完整内容的哈希，返回 (哈希, 读取字节数)"""
+    digest = hashlib.blake2b(digest_size=16)
+    count = 0
+    with open(filepath, 'rb') as f:
+        while True:
+            chunk = f.read(READ_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            count += len(chunk)
+    return digest.digest(), count
+
+
+def split_by(paths, hash_file, report):
+    """按 hash_file(路径) 的哈希把文件分组，只保留多于一个文件的组，返回 [(哈希, 文件列表), ...]"""
+    buckets = {}
+    for filepath in paths:
+        try:
+            key, count = hash_file(filepath)
+        except OSError:
+            continue    # 无法读取的文件不参与比较
+        report.bytes_read += count
+        buckets.setdefault(key, []).append(filepath)
+    return [(key, same) for key, same in buckets.items() if len(same) > 1]
+
+
+def keep_order(folder, filename):
+    """建议保留的顺序：已是整理后的文件名、文件名短、修改时间早的优先"""
+    base = os.path.basename(filename)
+    try:
+        mtime_ns = os.stat(os.path.join(folder, filename)).st_mtime_ns
+    except OSError:
+        mtime_ns = 0
+    return engine.process_filename(base) != base, len(base), mtime_ns, filename
+
+
+def find_duplicates(folder, entries, full=True, cancel=None):
+    """查找内容相同的副本，entries 为 (文件名, 章/节/集, 编号, 大小)，返回 DuplicateReport"""
+    report = DuplicateReport()
+    for (_, kind, number, size), names in group_candidates(entries):
+        if cancel is not None and cancel.is_set():
+            report.cancelled = True
+            break
+        report.candidate_count += len(names)
+        report.candidate_bytes += size * len(names)
+
+        paths = {os.path.join(folder, name): name for name in names}
+        with instrument.stage('dupes.partial'):
+            matches = split_by(paths, partial_hash, report)
+        # 是否已覆盖全文按实际读取时的大小判断（文件可能在索引之后变大）
+        confirmed = []
+        for (actual_size, _), same in matches:
+            if covers_whole(actual_size):
+                confirmed.append((actual_size, same, True))
+            elif full:
+                with instrument.stage('dupes.full'):
+                    confirmed.extend((actual_size, more, True) for _, more in split_by(same, full_hash, report))
+            else:
+                confirmed.append((actual_size, same, False))
+        for actual_size, same, verified in confirmed:
+            files = sorted((paths[path] for path in same), key=lambda name: keep_order(folder, name))
+            report.groups.append(DuplicateGroup(kind, number, actual_size, files, verified))
+    return report
+
+
+def format_size(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def format_duplicate_report(report):
+    """检测结果文本，每组列出建议保留和可删除的副本"""
+    lines = []
+    for group in report.groups:
+        where = f"[{group.folder}] " if group.folder else ""
+        note = "" if group.verified else "，仅比较了开头和结尾"
+        lines.append(f"{where}第{group.number}{group.kind}: {len(group.files)} 个相同副本，"
+                     f"各 {format_size(group.size)}{note}")
+        lines.append(f"  保留 {group.keep}")
+        for filename in group.remove:
+            lines.append(f"  删除 {filename}")
+    if report.groups:
+        lines.append(f"共 {len(report.groups)} 组重复，删除多余副本可释放 {format_size(report.wasted_bytes)}")
+    else:
+        lines.append("没有发现重复的文件")
+    lines.append(f"比较了 {report.candidate_count} 个编号和大小相同的文件"
+                 f"（共 {format_size(report.candidate_bytes)}），实际读取 {format_size(report.bytes_read)}")
+    return "\n".join(lines)
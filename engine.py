@@ -0,0 +1,311 @@
+"""重命名核心逻辑（不依赖图形界面）
+
+所有函数只处理普通数据：输入文件名列表，输出 (原文件名, 新文件名) 组成的
+重命名计划，可同时供图形界面和命令行使用。文件名的识别和改写由 rules 中
+的默认规则完成，每个文件名只解析一次。
+"""
+import os
+import re
+
+import fsio
+import instrument
+import rules
+
+# 默认编号位数
+NUMBER_WIDTH = 4
+
+# 本工具自身使用的文件（日志、临时文件）的前缀，遍历时跳过
+RESERVED_PREFIX = '.rename-'
+
+DIGIT_RUN = re.compile(r'(\d+)')
+
+
+class OperationResult:
+    """批量操作结果"""
+
+    def __init__(self):
+        self.success_count = 0
+        self.skipped_count = 0
+        self.failed = []
+        self.rewritten = []
+        self.renamed = []       # 实际生效的 (原文件名, 新文件名)
+        self.cancelled = False
+
+    def add_success(self):
+        self.success_count += 1
+
+    def add_skipped(self):
+        self.skipped_count += 1
+
+    def add_failure(self, detail):
+        self.failed.append(detail)
+
+
+def iter_files(folder, recursive=False, extensions=None):
+    """逐个产出文件夹中的文件（相对路径）
+
+    基于 os.scandir，直接使用 DirEntry 缓存的类型信息，不再对每个文件额外
+    调用 stat；recursive 为真时进入子文件夹（如分季/分卷目录）；extensions
+    为小写扩展名集合时，在遍历过程中直接过滤。
+    """
+    if not folder or not os.path.isdir(folder):
+        raise NotADirectoryError(folder)
+    if recursive and fsio.workers > 1:
+        return instrument.wrap_iter('scan', _walk_concurrent(folder, extensions))
+    return instrument.wrap_iter('scan', _walk(folder, recursive, extensions))
+
+
+def _scan_dir(folder, relative, extensions):
+    """扫描一个目录，返回 (文件列表, 子文件夹列表)"""
+    files = []
+    subdirs = []
+    with os.scandir(os.path.join(folder, relative)) as entries:
+        for entry in entries:
+            if entry.name.startswith(RESERVED_PREFIX):
+                continue
+            name = os.path.join(relative, entry.name) if relative else entry.name
+            if entry.is_file():
+                if extensions is None or os.path.splitext(entry.name)[1].lower() in extensions:
+                    files.append(name)
+            elif entry.is_dir(follow_symlinks=False):
+                subdirs.append(name)
+    return files, subdirs
+
+
+def _walk(folder, recursive, extensions):
+    """iter_files 的生成器实现，文件夹有效性已在调用前检查"""
+    pending = [""]
+    while pending:
+        files, subdirs = _scan_dir(folder, pending.pop(), extensions)
+        yield from files
+        if recursive:
+            # 逆序入栈，保证子文件夹按扫描顺序处理
+            pending.extend(reversed(subdirs))
+
+
+def _walk_concurrent(folder, extensions):
+    """逐层并发扫描子文件夹（用于高延迟的网络共享），文件顺序与 _walk 不同"""
+    level = [""]
+    while level:
+        next_level = []
+        for files, subdirs in fsio.imap_unordered(lambda relative: _scan_dir(folder, relative, extensions), level):
+            yield from files
+            next_level.extend(subdirs)
+        level = next_level
+
+
+def list_files(folder, recursive=False, extensions=None):
+    """获取文件夹中的文件列表"""
+    return list(iter_files(folder, recursive, extensions))
+
+
+def iter_batches(items, size):
+    """把可迭代对象切分为固定大小的列表"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def extract_pipeline():
+    """“提取章节信息”：只保留“第XXX章/节/集”部分"""
+    return rules.default_pipeline(('extract',))
+
+
+def unify_pipeline(width=NUMBER_WIDTH):
+    """“统一编号格式”：只保留带数字编号的部分，并补齐到指定位数"""
+    return rules.default_pipeline(('extract', ('pad', width)), require_number=True)
+
+
+def process_filename(filename):
+    """提取章节信息，只保留“第XXX章/节/集”部分"""
+    return extract_pipeline().transform(filename)
+
+
+def unify_filename(filename, width=NUMBER_WIDTH):
+    """统一编号格式，将数字编号补齐到指定位数"""
+    return unify_pipeline(width).transform(filename)
+
+
+def iter_plan(files, transform):
+    """逐个产出需要改名的 (原文件名, 新文件名)，不保留未改变的文件"""
+    for filename in files:
+        new_name = transform(filename)
+        if new_name != filename:
+            yield filename, new_name
+
+
+def natural_key(text):
+    """自然排序键：数字部分按数值比较，“第2集”排在“第10集”之前"""
+    parts = DIGIT_RUN.split(text)
+    parts[1::2] = map(int, parts[1::2])
+    return tuple(parts)
+
+
+def sort_key(folder_key, base, kind, number):
+    """按集数排序的键，folder_key 为 natural_key(文件夹)
+
+    同一文件夹中带编号的文件按 (章/节/集, 编号) 排在前面（中文编号同样按
+    数值），其余文件按自然顺序排在后面。
+    """
+    if number is None:
+        return folder_key, 1, natural_key(base)
+    return folder_key, 0, kind, number, base
+
+
+def episode_sort_key(filename):
+    """文件名的集数排序键，预览、计划和 planstore.PlanStore 使用同一顺序"""
+    folder, base = os.path.split(filename)
+    parsed = rules.DEFAULT_RULES.parse(filename)
+    if parsed is None:
+        return sort_key(natural_key(folder), base, None, None)
+    return sort_key(natural_key(folder), base, parsed.kind, parsed.number)
+
+
+def plan_key(row):
+    """计划条目按原文件名的集数排序"""
+    return episode_sort_key(row[0])
+
+
+def sort_plan(plan):
+    """按集数顺序排列计划"""
+    return sorted(plan, key=plan_key)
+
+
+def plan_rules(files, pipeline, stage='rules'):
+    """按规则步骤（rules.Pipeline）生成重命名计划，按集数排序"""
+    return sort_plan(iter_plan(files, instrument.wrap(stage, pipeline.transform)))
+
+
+def plan_extract(files):
+    """生成“提取章节信息”的重命名计划"""
+    return plan_rules(files, extract_pipeline(), 'process_filename')
+
+
+def plan_unify(files, width=NUMBER_WIDTH):
+    """生成“统一编号格式”的重命名计划"""
+    return plan_rules(files, unify_pipeline(width), 'unify_filename')
+
+
+def parse_episode(filename):
+    """解析数字编号，返回 (章/节/集, 编号)；没有编号时返回 None"""
+    parsed = rules.DEFAULT_RULES.parse(filename)
+    if parsed is None or parsed.number is None:
+        return None
+    return parsed.kind, parsed.number
+
+
+class EpisodeGroup:
+    """同一文件夹中同一类型（章/节/集）编号的检查结果
+
+    first/last 为主体编号的范围，missing 为缺失区间 [(起, 止), ...]，
+    duplicates 为 {编号: [文件名, ...]}，outliers 为远离主体的
+    [(编号, 文件名), ...]，不参与缺失计算。
+    """
+
+    def __init__(self, folder, kind):
+        self.folder = folder
+        self.kind = kind
+        self.count = 0
+        self.first = None
+        self.last = None
+        self.missing = []
+        self.missing_count = 0
+        self.duplicates = {}
+        self.outliers = []
+
+    @property
+    def complete(self):
+        return not (self.missing or self.duplicates or self.outliers)
+
+    def label(self, start, end=None):
+        """编号或区间的显示文本，如“第12–47集”"""
+        if end is None or end == start:
+            return f"第{start}{self.kind}"
+        return f"第{start}–{end}{self.kind}"
+
+
+# 与主体编号相差超过该值（且超过文件数）的编号视为异常值
+OUTLIER_GAP = 1000
+
+
+def find_missing(files):
+    """检查缺失集数，返回按 (文件夹, 章/节/集) 分组的 EpisodeGroup 列表"""
+    entries = []
+    for filename in files:
+        episode = parse_episode(filename)
+        if episode is not None:
+            entries.append((filename, episode[0], episode[1]))
+    return check_episodes(entries)
+
+
+def check_episodes(entries):
+    """根据 (文件名, 章/节/集, 编号) 检查缺失、重复和异常编号
+
+    每组只排序一次后顺序扫描，内存与文件数成正比，与编号范围无关。
+    """
+    groups = {}
+    for filename, kind, number in entries:
+        groups.setdefault((os.path.dirname(filename), kind), []).append((number, filename))
+    return [check_group(folder, kind, items) for (folder, kind), items in sorted(groups.items())]
+
+
+def check_group(folder, kind, items):
+    """检查一组编号，items 为 [(编号, 文件名), ...]"""
+    group = EpisodeGroup(folder, kind)
+    group.count = len(items)
+    items.sort()
+
+    # 去重，记录重复编号
+    numbers = []
+    names = []
+    for number, filename in items:
+        if numbers and numbers[-1] == number:
+            group.duplicates.setdefault(number, [names[-1]]).append(filename)
+        else:
+            numbers.append(number)
+            names.append(filename)
+
+    # 按大间隔切分，文件最多的一段为主体，其余为异常值
+    limit = max(OUTLIER_GAP, len(numbers))
+    best_start, best_end = 0, 0
+    start = 0
+    for index in range(1, len(numbers) + 1):
+        if index == len(numbers) or numbers[index] - numbers[index - 1] > limit:
+            if index - start > best_end - best_start:
+                best_start, best_end = start, index
+            start = index
+    group.outliers = [
+        (numbers[index], names[index])
+        for index in range(len(numbers)) if not best_start <= index < best_end
+    ]
+
+    group.first = numbers[best_start]
+    group.last = numbers[best_end - 1]
+    for index in range(best_start + 1, best_end):
+        previous, current = numbers[index - 1], numbers[index]
+        if current - previous > 1:
+            group.missing.append((previous + 1, current - 1))
+            group.missing_count += current - previous - 1
+    return group
+
+
+def format_episode_report(groups):
+    """检查结果文本，缺失编号按区间显示"""
+    lines = []
+    for group in groups:
+        where = f"[{group.folder}] " if group.folder else ""
+        summary = (f"{where}{group.label(group.first, group.last)}，共 {group.count} 个文件，"
+                   f"缺失 {group.missing_count} {group.kind}")
+        lines.append(summary)
+        for start, end in group.missing:
+            lines.append(f"  缺失 {group.label(start, end)}")
+        for number, filenames in sorted(group.duplicates.items()):
+            lines.append(f"  重复 {group.label(number)}: {'、'.join(filenames)}")
+        for number, filename in group.outliers:
+            lines.append(f"  异常编号 {group.label(number)}: {filename}")
+    return "\n".join(lines)
@@ -0,0 +1,245 @@
+"""文件夹索引
+
+在缓存目录中为每个文件夹保存一个 SQLite 索引，记录每个文件的名称、大小、
+修改时间、解析出的章/节/集与编号、提取结果以及上次同步的标题。再次打开
+同一文件夹时，目录修改时间未变的子目录直接使用索引，其余目录只重新解析
+大小或修改时间有变化的文件。
+"""
+import hashlib
+import os
+import sqlite3
+
+import engine
+import instrument
+from planstore import PlanStore
+
+# 索引结构版本，结构变化时递增以重建旧索引
+SCHEMA_VERSION = 3
+
+# SQLite INTEGER 能保存的最大编号；更大的编号保存为 NULL（kind 照常保存），读取时重新解析
+MAX_NUMBER = (1 << 63) - 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    parent TEXT,
+    mtime_ns INTEGER
+);
+CREATE TABLE IF NOT EXISTS files (
+    name TEXT PRIMARY KEY,
+    dir TEXT NOT NULL,
+    size INTEGER,
+    mtime_ns INTEGER,
+    kind TEXT,
+    number INTEGER,
+    extracted TEXT,
+    unified TEXT,
+    synced_title TEXT,
+    synced_size INTEGER,
+    synced_mtime_ns INTEGER
+);
+CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+"""
+
+
+def cache_dir():
+    """索引存放目录，可用环境变量 RENAME_CACHE_DIR 指定"""
+    path = os.environ.get('RENAME_CACHE_DIR')
+    if not path:
+        base = (os.environ.get('LOCALAPPDATA') or os.environ.get('XDG_CACHE_HOME')
+                or os.path.join(os.path.expanduser('~'), '.cache'))
+        path = os.path.join(base, 'rename')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def index_path(folder):
+    """文件夹对应的索引文件"""
+    key = os.path.normcase(os.path.abspath(folder)).encode('utf-8')
+    return os.path.join(cache_dir(), hashlib.sha1(key).hexdigest() + '.sqlite')
+
+
+def parse_row(name):
+    """解析单个文件名，返回索引中的解析字段"""
+    episode = engine.parse_episode(name)
+    kind, number = episode if episode is not None else (None, None)
+    if number is not None and number > MAX_NUMBER:
+        number = None
+    return kind, number, engine.process_filename(name), engine.unify_filename(name)
+
+
+def episode_rows(rows):
+    """补全 (文件名, 章/节/集, 编号, ...) 中因超出范围保存为 NULL 的编号"""
+    for name, kind, number, *rest in rows:
+        if number is None and kind is not None:
+            number = engine.parse_episode(name)[1]
+        yield (name, kind, number, *rest)
+
+
+class FolderIndex:
+    """单个文件夹的索引，用法: with FolderIndex(folder) as index: ..."""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.db = sqlite3.connect(index_path(folder))
+        if self.db.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            self.db.executescript("DROP TABLE IF EXISTS dirs; DROP TABLE IF EXISTS files;")
+            self.db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self.db.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def refresh(self, recursive=False, quick=True):
+        """与磁盘同步，返回重新解析的文件数
+
+        quick 为真时，修改时间未变的目录直接沿用索引（其中的文件没有增删
+        改名）；需要检测文件内容变化（如同步标签）时使用 quick=False。
+        """
+        if not os.path.isdir(self.folder):
+            raise NotADirectoryError(self.folder)
+
+        changed = 0
+        seen_dirs = set()
+        pending = [""]
+        while pending:
+            relative = pending.pop()
+            try:
+                mtime_ns = os.stat(os.path.join(self.folder, relative)).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            seen_dirs.add(relative)
+
+            row = self.db.execute("SELECT mtime_ns FROM dirs WHERE path = ?", (relative,)).fetchone()
+            if quick and row is not None and row[0] == mtime_ns:
+                subdirs = [path for (path,) in self.db.execute(
+                    "SELECT path FROM dirs WHERE parent = ?", (relative,))]
+            else:
+                count, subdirs = self.rescan_dir(relative)
+                changed += count
+                self.db.execute(
+                    "INSERT OR REPLACE INTO dirs (path, parent, mtime_ns) VALUES (?, ?, ?)",
+                    (relative, os.path.dirname(relative) if relative else None, mtime_ns)
+                )
+
+            if recursive:
+                pending.extend(subdirs)
+
+        if recursive:
+            # 已被删除的子目录
+            stale = {path for (path,) in self.db.execute("SELECT path FROM dirs")}
+            stale.update(path for (path,) in self.db.execute("SELECT DISTINCT dir FROM files"))
+            for path in stale - seen_dirs:
+                self.db.execute("DELETE FROM dirs WHERE path = ?", (path,))
+                self.db.execute("DELETE FROM files WHERE dir = ?", (path,))
+
+        self.db.commit()
+        return changed
+
+    def rescan_dir(self, relative):
+        """重新扫描一个目录，只解析新增或变化的文件，返回 (解析数, 子目录列表)"""
+        known = {
+            name: (size, mtime_ns) for name, size, mtime_ns in self.db.execute(
+                "SELECT name, size, mtime_ns FROM files WHERE dir = ?", (relative,))
+        }
+
+        parse = instrument.wrap('index.parse', parse_row)
+        changed = 0
+        subdirs = []
+        with os.scandir(os.path.join(self.folder, relative)) as entries:
+            for entry in entries:
+                if entry.name.startswith(engine.RESERVED_PREFIX):
+                    continue
+                name = os.path.join(relative, entry.name) if relative else entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(name)
+                    continue
+                if not entry.is_file():
+                    continue
+
+                stat = entry.stat()
+                if known.pop(name, None) == (stat.st_size, stat.st_mtime_ns):
+                    continue
+
+                self.db.execute(
+                    "INSERT OR REPLACE INTO files (name, dir, size, mtime_ns, kind, number, extracted, unified) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (name, relative, stat.st_size, stat.st_mtime_ns) + parse(name)
+                )
+                changed += 1
+
+        # 已不存在的文件
+        self.db.executemany("DELETE FROM files WHERE name = ?", [(name,) for name in known])
+        return changed, subdirs
+
+    def where(self, recursive):
+        """文件范围条件：只含顶层或包含子文件夹"""
+        return ("1", ()) if recursive else ("dir = ?", ("",))
+
+    def names(self, recursive=False):
+        """索引中的文件名"""
+        clause, params = self.where(recursive)
+        return [name for (name,) in self.db.execute(
+            f"SELECT name FROM files WHERE {clause} ORDER BY name", params)]
+
+    def plan_store(self, column, recursive):
+        """由缓存的结果列直接建立按集数排序的 PlanStore，编号取自索引，不再解析文件名"""
+        clause, params = self.where(recursive)
+        return PlanStore.from_rows(episode_rows(self.db.execute(
+            f"SELECT name, kind, number, {column} FROM files WHERE {clause} AND {column} != name", params)))
+
+    def plan_extract(self, recursive=False):
+        """使用缓存的提取结果生成“提取章节信息”计划（PlanStore）"""
+        return self.plan_store('extracted', recursive)
+
+    def plan_unify(self, recursive=False, width=engine.NUMBER_WIDTH):
+        """使用缓存的补齐结果生成“统一编号格式”计划（PlanStore）"""
+        if width != engine.NUMBER_WIDTH:
+            pipeline = engine.unify_pipeline(width)
+            return PlanStore.from_plan(engine.iter_plan(self.names(recursive), pipeline.transform))
+        return self.plan_store('unified', recursive)
+
+    def find_missing(self, recursive=False):
+        """使用缓存的编号检查缺失集数，返回值同 engine.find_missing"""
+        clause, params = self.where(recursive)
+        return engine.check_episodes(episode_rows(self.db.execute(
+            f"SELECT name, kind, number FROM files WHERE {clause} AND kind IS NOT NULL", params)))
+
+    def duplicate_entries(self, recursive=False):
+        """编号和大小都与其他文件相同的 (文件名, 章/节/集, 编号, 大小)，供 duplicates.find_duplicates 使用"""
+        clause, params = self.where(recursive)
+        return self.db.execute(
+            "SELECT name, kind, number, size FROM files JOIN ("
+            f"SELECT dir, kind, number, size FROM files WHERE {clause} AND number IS NOT NULL "
+            "GROUP BY dir, kind, number, size HAVING COUNT(*) > 1"
+            ") USING (dir, kind, number, size) ORDER BY name", params).fetchall()
+
+    def is_synced(self, name):
+        """上次同步后文件未变化且标题与文件名一致"""
+        row = self.db.execute(
+            "SELECT size, mtime_ns, synced_title, synced_size, synced_mtime_ns FROM files WHERE name = ?",
+            (name,)).fetchone()
+        title = os.path.splitext(os.path.basename(name))[0]
+        return row is not None and row[2] == title and row[0:2] == row[3:5]
+
+    def record_synced(self, names):
+        """记录标题已同步的文件及其当前大小和修改时间"""
+        for name in names:
+            try:
+                stat = os.stat(os.path.join(self.folder, name))
+            except OSError:
+                continue
+            title = os.path.splitext(os.path.basename(name))[0]
+            self.db.execute(
+                "UPDATE files SET size = ?, mtime_ns = ?, synced_title = ?, synced_size = ?, synced_mtime_ns = ? "
+                "WHERE name = ?",
+                (stat.st_size, stat.st_mtime_ns, title, stat.st_size, stat.st_mtime_ns, name)
+            )
+        self.db.commit()
@@ -0,0 +1,217 @@
+"""可选的耗时统计
+
+默认关闭：stage() 返回共享的空上下文，wrap()/wrap_iter() 原样返回，
+关闭时几乎没有额外开销。开启后按阶段记录调用次数、总耗时和按 2 的幂
+划分的延迟直方图（微秒），可导出为 JSON 汇总或 Chrome trace 文件
+（chrome://tracing 或 Perfetto 打开）。
+
+开启方式：命令行 --profile/--trace 参数，或环境变量 RENAME_PROFILE
+（值为汇总 JSON 的保存路径，设为 1 时只统计不保存）。
+"""
+import json
+import os
+import threading
+import time
+
+# 最多保留的 trace 事件数，超出后只统计不记录事件
+MAX_EVENTS = 200000
+
+enabled = False
+stats = {}      # 阶段 -> [次数, 总秒数, {桶序号: 次数}]
+events = []     # (阶段, 开始秒数, 耗时秒数, 进程号, 线程号)
+lock = threading.Lock()
+origin = time.perf_counter()
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def reset():
+    with lock:
+        stats.clear()
+        events.clear()
+
+
+def bucket(seconds):
+    """延迟桶：第 i 桶表示小于 2**i 微秒"""
+    return int(seconds * 1e6).bit_length()
+
+
+def record(name, started, elapsed):
+    """记录一次耗时"""
+    with lock:
+        entry = stats.get(name)
+        if entry is None:
+            entry = stats[name] = [0, 0.0, {}]
+        entry[0] += 1
+        entry[1] += elapsed
+        index = bucket(elapsed)
+        entry[2][index] = entry[2].get(index, 0) + 1
+        if len(events) < MAX_EVENTS:
+            events.append((name, started - origin, elapsed, os.getpid(), threading.get_ident()))
+
+
+class Timer:
+    """计时上下文"""
+
+    __slots__ = ('name', 'started')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record(self.name, self.started, time.perf_counter() - self.started)
+
+
+class NullTimer:
+    """关闭时使用的空上下文"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+def stage(name):
+    """计时上下文：with stage('rename'): ..."""
+    return Timer(name) if enabled else NULL_TIMER
+
+
+def wrap(name, func):
+    """给函数加上计时；关闭时原样返回，逐项调用没有额外开销"""
+    if not enabled:
+        return func
+
+    def timed(*args, **kwargs):
+        with Timer(name):
+            return func(*args, **kwargs)
+    return timed
+
+
+def wrap_iter(name, iterable):
+    """给迭代器的每次取值计时（不含调用方处理的时间）；关闭时原样返回"""
+    if not enabled:
+        return iterable
+    return _timed_iter(name, iter(iterable))
+
+
+def _timed_iter(name, iterator):
+    while True:
+        started = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        record(name, started, time.perf_counter() - started)
+        yield item
+
+
+def snapshot():
+    """当前统计的可序列化副本（用于从工作进程传回）"""
+    with lock:
+        return {
+            'stats': {name: [count, total, dict(buckets)] for name, (count, total, buckets) in stats.items()},
+            'events': list(events),
+        }
+
+
+def merge(data):
+    """合并其他进程的统计"""
+    if not data:
+        return
+    with lock:
+        for name, (count, total, buckets) in data['stats'].items():
+            entry = stats.get(name)
+            if entry is None:
+                entry = stats[name] = [0, 0.0, {}]
+            entry[0] += count
+            entry[1] += total
+            for index, hits in buckets.items():
+                entry[2][index] = entry[2].get(index, 0) + hits
+        room = MAX_EVENTS - len(events)
+        events.extend(data['events'][:max(0, room)])
+
+
+def percentile(buckets, count, fraction):
+    """由直方图估算分位数的上界（微秒）"""
+    target = count * fraction
+    seen = 0
+    for index in sorted(buckets):
+        seen += buckets[index]
+        if seen >= target:
+            return 2 ** index
+    return 0
+
+
+def summary():
+    """按阶段汇总：次数、总耗时、平均值、p50/p99 和直方图"""
+    with lock:
+        items = sorted(stats.items(), key=lambda item: item[1][1], reverse=True)
+        return {
+            name: {
+                'count': count,
+                'total_s': total,
+                'mean_us': total / count * 1e6,
+                'p50_us': percentile(buckets, count, 0.5),
+                'p99_us': percentile(buckets, count, 0.99),
+                'histogram_us': {f"<{2 ** index}": hits for index, hits in sorted(buckets.items())},
+            }
+            for name, (count, total, buckets) in items
+        }
+
+
+def format_summary():
+    """汇总文本，用于结果对话框和命令行输出"""
+    rows = summary()
+    if not rows:
+        return "没有耗时统计"
+    lines = [f"{'阶段':<24}{'次数':>8}{'总耗时ms':>12}{'平均µs':>10}{'p50µs':>9}{'p99µs':>9}"]
+    for name, row in rows.items():
+        lines.append(
+            f"{name:<24}{row['count']:>8}{row['total_s'] * 1000:>12.1f}"
+            f"{row['mean_us']:>10.1f}{row['p50_us']:>9}{row['p99_us']:>9}"
+        )
+    return "\n".join(lines)
+
+
+def export_summary(path):
+    """保存 JSON 汇总"""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(summary(), f, ensure_ascii=False, indent=2)
+
+
+def export_trace(path):
+    """保存 Chrome trace 事件文件"""
+    with lock:
+        trace = [
+            {'name': name, 'ph': 'X', 'ts': started * 1e6, 'dur': elapsed * 1e6, 'pid': pid, 'tid': tid}
+            for name, started, elapsed, pid, tid in events
+        ]
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'traceEvents': trace}, f, ensure_ascii=False)
+
+
+def enable_from_env():
+    """根据环境变量 RENAME_PROFILE 开启，返回汇总保存路径（可能为 None）"""
+    value = os.environ.get('RENAME_PROFILE')
+    if not value:
+        return None
+    enable()
+    return None if value == '1' else value
@@ -0,0 +1,518 @@
+"""重命名事务
+
+执行前先检查整个计划中的冲突和循环（如 A→B、B→A），循环通过临时文件名
+中转。所有步骤在执行前一次性写入文件夹中的追加式日志并 fsync，之后每完成
+一步追加一条标记；中途崩溃时可根据日志继续执行或回滚。每批结束后保存
+反向映射，可一步撤销最近一次重命名；一次操作分多批执行时（如导入大型
+计划），各批的反向映射依次保存在同一个撤销文件中，撤销时合并为一次。
+"""
+import json
+import os
+import shutil
+import threading
+
+import fsio
+import instrument
+from engine import RESERVED_PREFIX, OperationResult
+
+# 日志文件名（位于目标文件夹中）
+JOURNAL_NAME = RESERVED_PREFIX + 'journal.jsonl'
+
+# 最近一次重命名的反向映射
+UNDO_NAME = RESERVED_PREFIX + 'undo.jsonl'
+
+# 步骤标记
+DONE = 'done'
+FAILED = 'failed'
+UNDONE = 'undone'
+
+
+class JournalError(Exception):
+    """日志状态不允许当前操作，例如存在未完成的重命名"""
+
+
+def name_key(name):
+    """文件名比较键（不区分大小写的文件系统上忽略大小写）"""
+    return os.path.normcase(name)
+
+
+def list_dir(folder, relative):
+    """列出一个目录中的文件名键，目录不存在时为空"""
+    names = []
+    try:
+        with os.scandir(os.path.join(folder, relative)) as entries:
+            for entry in entries:
+                name = os.path.join(relative, entry.name) if relative else entry.name
+                names.append(name_key(name))
+    except FileNotFoundError:
+        pass
+    return names
+
+
+def list_existing(folder, plan):
+    """一次性列出计划涉及的各目录中已有的文件名，避免逐个 exists 检查"""
+    dirs = {os.path.dirname(name) for pair in plan for name in pair}
+    existing = set()
+    for names in fsio.imap_unordered(lambda relative: list_dir(folder, relative), dirs):
+        existing.update(names)
+    return existing
+
+
+def temp_name(src, batch, existing):
+    """循环重命名使用的临时文件名"""
+    head, tail = os.path.split(src)
+    candidate = os.path.join(head, f"{RESERVED_PREFIX}{batch}-{tail}")
+    counter = 0
+    while name_key(candidate) in existing:
+        counter += 1
+        candidate = os.path.join(head, f"{RESERVED_PREFIX}{batch}-{counter}-{tail}")
+    existing.add(name_key(candidate))
+    return candidate
+
+
+def plan_steps(folder, plan, batch, deferred=None):
+    """检查计划并排好执行顺序
+
+    返回 (units, failures)。units 为 [(是否循环, [(src, dst), ...]), ...]，
+    每个单元是一条链或一个循环，单元内的步骤必须按顺序执行；循环的第一步
+    把文件移到临时名，最后一步从临时名移到最终位置。failures 为无法执行的
+    条目说明。deferred 为列表时，因目标已存在而无法执行的条目加入其中，
+    不计为失败（分批执行时目标可能在后面的批次中才被移走）。
+    """
+    existing = list_existing(folder, plan)
+    failures = []
+    mapping = {}   # 源文件键 -> (src, dst)
+    targets = {}   # 目标文件键 -> 源文件键
+
+    for src, dst in plan:
+        if src == dst:
+            continue
+        ks, kd = name_key(src), name_key(dst)
+        if ks not in existing:
+            failures.append(f"{src} → {dst} (源文件不存在)")
+        elif ks in mapping:
+            failures.append(f"{src} → {dst} (重复的源文件)")
+        elif kd in targets:
+            failures.append(f"{src} → {dst} (与其他文件的目标文件名相同)")
+        else:
+            mapping[ks] = (src, dst)
+            targets[kd] = ks
+
+    # 目标已存在且不会被移走的条目无法执行；等待这些源文件移走的条目也随之失败
+    rejected = [
+        ks for kd, ks in targets.items()
+        if kd != ks and kd in existing and kd not in mapping
+    ]
+    while rejected:
+        ks = rejected.pop()
+        src, dst = mapping.pop(ks)
+        del targets[name_key(dst)]
+        if deferred is not None:
+            deferred.append((src, dst))
+        else:
+            failures.append(f"{src} → {dst} (目标文件已存在)")
+        waiting = targets.get(ks)
+        if waiting is not None and waiting != ks:
+            rejected.append(waiting)
+
+    units = []
+    visited = set()
+
+    # 链：从目标空闲的一端开始，逐个向前
+    for ks, (src, dst) in mapping.items():
+        kd = name_key(dst)
+        if kd in mapping and kd != ks:
+            continue
+        steps = []
+        current = ks
+        while current is not None:
+            steps.append(mapping[current])
+            visited.add(current)
+            previous = targets.get(current)
+            current = previous if previous != current else None
+        units.append((False, steps))
+
+    # 剩下的都在循环中：先移到临时名，依次填补空位，最后从临时名移回
+    for ks, (src, dst) in mapping.items():
+        if ks in visited:
+            continue
+        tmp = temp_name(src, batch, existing)
+        steps = [(src, tmp)]
+        visited.add(ks)
+        current = targets[ks]
+        while current != ks:
+            steps.append(mapping[current])
+            visited.add(current)
+            current = targets[current]
+        steps.append((tmp, dst))
+        units.append((True, steps))
+
+    return units, failures
+
+
+class Journal:
+    """追加式重命名日志
+
+    第一行为批次信息，随后每个步骤一行，写完后 fsync 一次；执行过程中
+    每一步追加一条 done/failed/undone 标记。提交后删除日志文件。
+    """
+
+    def __init__(self, path, batch, steps, marks, append_undo=False):
+        self.path = path
+        self.batch = batch
+        self.steps = steps      # [(单元序号, 是否循环, src, dst), ...]
+        self.marks = marks      # 步骤序号 -> 最新标记
+        self.append_undo = append_undo  # 提交时保留同一操作前几批的撤销信息
+        self.file = None
+        self.lock = threading.Lock()    # 并发执行单元时保护标记的写入
+
+    @classmethod
+    def create(cls, folder, batch, units, append_undo=False):
+        """写入全部步骤并 fsync"""
+        path = os.path.join(folder, JOURNAL_NAME)
+        steps = [
+            (unit, cyclic, src, dst)
+            for unit, (cyclic, unit_steps) in enumerate(units)
+            for src, dst in unit_steps
+        ]
+
+        journal = cls(path, batch, steps, {}, append_undo)
+        journal.file = open(path, 'x', encoding='utf-8')
+        header = {'batch': batch, 'steps': len(steps)}
+        if append_undo:
+            header['append_undo'] = True
+        journal.write(header)
+        for index, (unit, cyclic, src, dst) in enumerate(steps):
+            journal.write({'step': index, 'unit': unit, 'cycle': cyclic, 'src': src, 'dst': dst})
+        journal.file.flush()
+        with instrument.stage('journal.fsync'):
+            os.fsync(journal.file.fileno())
+        return journal
+
+    @classmethod
+    def load(cls, folder):
+        """读取未完成的日志；步骤未完整写入（执行前崩溃）时返回 None"""
+        path = os.path.join(folder, JOURNAL_NAME)
+        header = None
+        steps = []
+        marks = {}
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # 崩溃时最后一行可能不完整
+                    break
+                if header is None:
+                    header = record
+                elif 'step' in record:
+                    steps.append((record['unit'], record['cycle'], record['src'], record['dst']))
+                else:
+                    for mark in (DONE, FAILED, UNDONE):
+                        if mark in record:
+                            marks[record[mark]] = mark
+
+        if header is None or len(steps) != header['steps']:
+            return None
+
+        journal = cls(path, header['batch'], steps, marks, header.get('append_undo', False))
+        journal.file = open(path, 'a', encoding='utf-8')
+        return journal
+
+    def write(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def mark(self, index, mark):
+        """追加一条步骤标记（立即写出，不单独 fsync）"""
+        with self.lock:
+            self.marks[index] = mark
+            self.write({mark: index})
+            self.file.flush()
+
+    def units(self):
+        """按单元产出 (是否循环, 步骤序号列表)"""
+        start = 0
+        total = len(self.steps)
+        while start < total:
+            end = start
+            while end < total and self.steps[end][0] == self.steps[start][0]:
+                end += 1
+            yield self.steps[start][1], list(range(start, end))
+            start = end
+
+    def effective_renames(self):
+        """本批实际生效的 (原文件名, 新文件名)，临时文件名已合并"""
+        for cyclic, indices in self.units():
+            done = [i for i in indices if self.marks.get(i) == DONE]
+            if cyclic:
+                # 循环要么全部完成，要么已整体回滚
+                if len(done) == len(indices):
+                    first, last = self.steps[indices[0]], self.steps[indices[-1]]
+                    for index in indices[1:-1]:
+                        yield self.steps[index][2], self.steps[index][3]
+                    yield first[2], last[3]
+            else:
+                for index in done:
+                    yield self.steps[index][2], self.steps[index][3]
+
+    def commit(self):
+        """整批结束：保存撤销信息，fsync 后删除日志"""
+        renames = list(self.effective_renames())
+        if renames:
+            save_undo(os.path.dirname(self.path), self.batch, renames, self.append_undo)
+
+        self.write({'state': 'commit'})
+        self.file.flush()
+        with instrument.stage('journal.fsync'):
+            os.fsync(self.file.fileno())
+        self.file.close()
+        os.remove(self.path)
+
+
+def save_undo(folder, batch, renames, append=False):
+    """保存反向映射 [新文件名, 原文件名]，先写临时文件再替换
+
+    append 为真时保留已有的撤销信息，本批作为新的一段写在后面。
+    """
+    path = os.path.join(folder, UNDO_NAME)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        if append and os.path.exists(path):
+            with open(path, encoding='utf-8') as previous:
+                shutil.copyfileobj(previous, f)
+        f.write(json.dumps({'batch': batch, 'count': len(renames)}) + '\n')
+        for src, dst in renames:
+            f.write(json.dumps([dst, src], ensure_ascii=False) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+def has_undo(folder):
+    """是否有可撤销的重命名"""
+    return os.path.exists(os.path.join(folder, UNDO_NAME))
+
+
+def load_undo(folder):
+    """读取撤销计划 [(当前文件名, 原文件名), ...]"""
+    path = os.path.join(folder, UNDO_NAME)
+    if not os.path.exists(path):
+        raise JournalError("没有可撤销的重命名")
+
+    segments = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            record = json.loads(line)
+            if isinstance(record, dict):
+                segments.append((record['count'], []))
+            else:
+                segments[-1][1].append(tuple(record))
+
+    if not segments or any(len(plan) != count for count, plan in segments):
+        raise JournalError("撤销信息不完整，无法撤销")
+    if len(segments) == 1:
+        return segments[0][1]
+    return merge_undo(plan for _, plan in segments)
+
+
+def merge_undo(segments):
+    """把依次执行的各批反向映射合并为一次撤销 [(当前文件名, 原文件名), ...]
+
+    同一批中的改名视为同时发生（链和循环），后一批的原文件名可能是前一批
+    的新文件名，合并后直接指向最初的文件名。
+    """
+    origins = {}
+    for plan in segments:
+        moved = {current: origins.get(previous, previous) for current, previous in plan}
+        for _, previous in plan:
+            origins.pop(previous, None)
+        origins.update(moved)
+    return [(current, origin) for current, origin in origins.items() if current != origin]
+
+
+def pending_journal(folder):
+    """文件夹中是否有未完成的重命名"""
+    return os.path.exists(os.path.join(folder, JOURNAL_NAME))
+
+
+def discard_incomplete(folder):
+    """删除未写完的日志（执行前崩溃，没有任何文件被改名）"""
+    os.remove(os.path.join(folder, JOURNAL_NAME))
+
+
+def run_unit(folder, journal, indices, result):
+    """执行一个单元中尚未完成的步骤
+
+    链中某一步失败时，后续步骤的目标仍被占用，全部跳过；循环中某一步
+    失败时回滚本单元已完成的步骤，保证文件不会停留在临时名上。
+    """
+    steps = journal.steps
+    completed = []
+    for position, index in enumerate(indices):
+        if journal.marks.get(index) == DONE:
+            completed.append(index)
+            continue
+
+        _, cyclic, src, dst = steps[index]
+        try:
+            with instrument.stage('rename'):
+                os.rename(os.path.join(folder, src), os.path.join(folder, dst))
+        except OSError as e:
+            journal.mark(index, FAILED)
+            if cyclic:
+                rollback_steps(folder, journal, reversed(completed))
+                first, last = steps[indices[0]], steps[indices[-1]]
+                result.add_failure(f"{first[2]} → {last[3]} (错误: {str(e)})")
+                for other in indices[1:-1]:
+                    result.add_failure(f"{steps[other][2]} → {steps[other][3]} (循环重命名已回滚)")
+            else:
+                result.add_failure(f"{src} → {dst} (错误: {str(e)})")
+                for other in indices[position + 1:]:
+                    journal.mark(other, FAILED)
+                    result.add_failure(f"{steps[other][2]} → {steps[other][3]} (前置重命名失败)")
+            return
+
+        journal.mark(index, DONE)
+        completed.append(index)
+
+    # 循环的第一步只是移到临时名，不计入成功数
+    for index in completed:
+        if not (steps[index][1] and index == indices[0]):
+            result.add_success()
+
+
+def rollback_steps(folder, journal, indices):
+    """按给定顺序撤销已完成的步骤"""
+    for index in indices:
+        _, _, src, dst = journal.steps[index]
+        try:
+            with instrument.stage('rename'):
+                os.rename(os.path.join(folder, dst), os.path.join(folder, src))
+        except OSError as e:
+            raise JournalError(f"回滚失败: {dst} → {src} ({str(e)})，日志已保留") from e
+        journal.mark(index, UNDONE)
+
+
+def run_journal(folder, journal, result, progress=None, cancel=None):
+    """按单元执行日志中的步骤，只在单元之间响应取消
+
+    单元之间没有先后关系，fsio.workers 大于 1 时多个单元同时执行；单元内
+    的步骤始终按顺序执行。
+    """
+    total = len(journal.steps)
+
+    def pending_units():
+        for _, indices in journal.units():
+            if cancel is not None and cancel.is_set():
+                result.cancelled = True
+                return
+            # 继续执行时跳过已经结束（全部完成或已失败）的单元
+            marks = [journal.marks.get(i) for i in indices]
+            if not any(mark in (FAILED, UNDONE) for mark in marks) and marks.count(DONE) < len(marks):
+                yield indices
+
+    def run(indices):
+        unit_result = OperationResult()
+        run_unit(folder, journal, indices, unit_result)
+        return len(indices), unit_result
+
+    done = 0
+    for count, unit_result in fsio.imap_unordered(run, pending_units()):
+        result.success_count += unit_result.success_count
+        result.failed.extend(unit_result.failed)
+        done += count
+        if progress is not None:
+            progress(done, total)
+    if progress is not None and not result.cancelled:
+        progress(total, total)
+
+    result.renamed.extend(journal.effective_renames())
+    journal.commit()
+    return result
+
+
+def apply_renames(folder, plan, progress=None, cancel=None, deferred=None, append_undo=False):
+    """以事务方式执行重命名计划，返回 OperationResult
+
+    progress(done, total) 按步骤回调；cancel 为 threading.Event，在两个
+    单元之间检查，已完成的单元保持不变。deferred 的用法同 plan_steps。
+    append_undo 为真表示本批是同一操作的后续批次，撤销信息追加在前几批之后。
+    plan 可以是列表或 planstore.PlanStore 等可重复迭代的计划，生成器先展开。
+    """
+    if pending_journal(folder):
+        raise JournalError("该文件夹有未完成的重命名，请先继续执行或回滚")
+
+    if not hasattr(plan, '__len__'):
+        plan = list(plan)
+    batch = os.urandom(4).hex()
+    units, failures = plan_steps(folder, plan, batch, deferred)
+
+    result = OperationResult()
+    for detail in failures:
+        result.add_failure(detail)
+
+    if not units:
+        return result
+
+    journal = Journal.create(folder, batch, units, append_undo)
+    return run_journal(folder, journal, result, progress, cancel)
+
+
+def settle_in_flight(folder, journal):
+    """确定崩溃时正在执行的步骤是否已完成
+
+    标记在每步之后立即写出，因此每个单元最多只有第一个无标记的步骤状态
+    未知（并发执行时可能有多个单元同时在执行）：源文件已不存在且目标存在，
+    说明重命名已完成但标记未写入。
+    """
+    existing = list_existing(folder, [(src, dst) for _, _, src, dst in journal.steps])
+    for _, indices in journal.units():
+        for index in indices:
+            mark = journal.marks.get(index)
+            if mark == DONE:
+                continue
+            if mark is None:
+                _, _, src, dst = journal.steps[index]
+                if name_key(src) not in existing and name_key(dst) in existing:
+                    journal.mark(index, DONE)
+            break
+
+
+def resume(folder, progress=None, cancel=None):
+    """继续执行未完成的重命名"""
+    journal = Journal.load(folder)
+    if journal is None:
+        discard_incomplete(folder)
+        return OperationResult()
+
+    settle_in_flight(folder, journal)
+    return run_journal(folder, journal, OperationResult(), progress, cancel)
+
+
+def rollback(folder, progress=None):
+    """撤销未完成批次中已完成的步骤，恢复原文件名"""
+    result = OperationResult()
+    journal = Journal.load(folder)
+    if journal is None:
+        discard_incomplete(folder)
+        return result
+
+    settle_in_flight(folder, journal)
+    done = [i for i, _ in enumerate(journal.steps) if journal.marks.get(i) == DONE]
+    for count, index in enumerate(reversed(done)):
+        if progress is not None:
+            progress(count, len(done))
+        rollback_steps(folder, journal, [index])
+        result.add_success()
+
+    journal.commit()
+    return result
+
+
+def undo(folder, progress=None, cancel=None):
+    """撤销最近一次重命名
+
+    反向映射作为新的一批重命名执行，同样检查冲突并处理循环；执行后
+    保存的撤销信息指向撤销前的状态，再次撤销即可恢复。
+    """
+    return apply_renames(folder, load_undo(folder), progress, cancel)
@@ -0,0 +1,78 @@
+"""重命名并同步标题（一次完成）
+
+原来的流程先重命名，再重新列出文件夹、逐个打开音频文件同步标题。这里
+只扫描一次：按计划先把每个音频文件的标题写成它的新文件名（仍在原路径，
+只打开一次），然后以事务方式执行重命名。
+
+每个文件要么改名且标题一致，要么保持原名：
+- 标题写入失败的文件不参与重命名（依赖它的链也一并跳过），记为失败；
+- 标题已写好但重命名失败（或被取消）的文件，把标题改回当前文件名，
+  与单独同步标题的结果相同；这一步也失败时单独记录。
+中途崩溃时，重新执行同样的操作即可：已写好的标题会被跳过。
+"""
+import os
+
+import journal
+from engine import OperationResult
+
+
+def title_of(filename):
+    return os.path.splitext(os.path.basename(filename))[0]
+
+
+def rename_and_tag(folder, plan, unchanged=(), progress=None, cancel=None, force=False, append_undo=False):
+    """执行重命名计划并同步音频标题，返回 (重命名结果, 标题结果)
+
+    plan 为 [(原文件名, 新文件名), ...]，其中的音频文件标题设为新文件名；
+    unchanged 为不需要改名、但也要同步标题的音频文件。progress、cancel 和
+    append_undo 的用法同 journal.apply_renames，先报告标题进度，再报告重命名进度。
+    """
+    import tags
+
+    if journal.pending_journal(folder):
+        raise journal.JournalError("该文件夹有未完成的重命名，请先继续执行或回滚")
+
+    plan = list(plan)
+    targets = [
+        (src, dst) for src, dst in plan
+        if os.path.splitext(dst)[1].lower() in tags.AUDIO_EXTENSIONS
+    ]
+    targets.extend((name, name) for name in unchanged)
+
+    # 第一步：在原路径写入最终标题
+    tag_result = OperationResult()
+    tagged = []
+    rejected = set()
+    for done, (src, dst) in enumerate(targets):
+        if cancel is not None and cancel.is_set():
+            tag_result.cancelled = True
+            break
+        if progress is not None:
+            progress(done, len(targets))
+        outcome = tags.sync_one(folder, src, force, title_of(dst))
+        tags.record_outcome(tag_result, *outcome)
+        if outcome[2] is None:
+            tagged.append((src, dst))
+        else:
+            rejected.add(src)
+
+    # 第二步：重命名（标题失败的文件不改名；取消时不再开始）
+    if tag_result.cancelled:
+        rename_result = OperationResult()
+        rename_result.cancelled = True
+    else:
+        rename_result = journal.apply_renames(
+            folder, [(src, dst) for src, dst in plan if src not in rejected], progress, cancel,
+            append_undo=append_undo
+        )
+
+    # 第三步：标题已改但文件未改名时，恢复为与当前文件名一致
+    renamed = set(rename_result.renamed)
+    for src, dst in tagged:
+        if src == dst or (src, dst) in renamed:
+            continue
+        _, _, error_detail = tags.sync_one(folder, src, force)
+        if error_detail is not None:
+            tag_result.add_failure(f"{src} (重命名失败且无法恢复标题: {error_detail})")
+
+    return rename_result, tag_result
@@ -0,0 +1,82 @@
+"""中文数字解析
+
+支持小写（一二三、〇/零、两）、大写（壹贰叁……拾佰仟）和繁体写法，单位
+十/百/千/万/亿，口语省略（一百五 = 150、两千三 = 2300）以及逐位读法
+（二〇二四 = 2024）。结果按字符串缓存，同一文件夹中反复出现的编号只解析一次。
+"""
+from functools import lru_cache
+
+# 数字字符 -> 数值
+DIGITS = {}
+for _value, _chars in enumerate(("零〇", "一壹", "二贰貳两兩", "三叁參", "四肆", "五伍",
+                                 "六陆陸", "七柒", "八捌", "九玖")):
+    for _char in _chars:
+        DIGITS[_char] = _value
+
+# 小单位（一个“节”之内）
+UNITS = {'十': 10, '拾': 10, '百': 100, '佰': 100, '千': 1000, '仟': 1000}
+
+# 大单位（分节）
+SECTIONS = {'万': 10 ** 4, '萬': 10 ** 4, '亿': 10 ** 8, '億': 10 ** 8}
+
+# 可出现在中文编号中的全部字符，用于构造正则字符类
+CHARACTERS = ''.join(DIGITS) + ''.join(UNITS) + ''.join(SECTIONS)
+
+
+@lru_cache(maxsize=4096)
+def parse(text):
+    """把中文数字转换为整数；无法识别时返回 None"""
+    if not text:
+        return None
+    if not any(char in UNITS or char in SECTIONS for char in text):
+        # 逐位读法：二〇二四
+        digits = [DIGITS.get(char) for char in text]
+        if None in digits:
+            return None
+        value = 0
+        for digit in digits:
+            value = value * 10 + digit
+        return value
+
+    total = 0           # 已完成的大单位部分
+    section = 0         # 当前节（万以下）
+    digit = None        # 尚未乘单位的数字
+    last_unit = 0       # 上一个小单位，用于口语省略
+    for char in text:
+        if char in DIGITS:
+            if digit is not None and DIGITS[char] != 0 and digit != 0:
+                return None     # 两个数字相连，如“一二百”
+            digit = DIGITS[char]
+            if digit == 0:
+                last_unit = 0
+        elif char in UNITS:
+            unit = UNITS[char]
+            if last_unit and unit >= last_unit and digit is None:
+                return None     # 单位重复，如“十十”
+            section += (1 if digit is None else digit) * unit
+            digit = None
+            last_unit = unit
+        elif char in SECTIONS:
+            unit = SECTIONS[char]
+            if digit is not None:
+                section += digit
+            if section == 0 and total == 0:
+                return None
+            total = (total + section) * unit if total % unit else total + section * unit
+            section = 0
+            digit = None
+            last_unit = unit
+        else:
+            return None
+
+    if digit is not None:
+        # 口语省略：一百五 = 一百五十，一万五 = 一万五千
+        section += digit * (last_unit // 10 if last_unit > 10 else 1)
+    return total + section
+
+
+def to_int(text):
+    """阿拉伯数字（含全角）或中文数字转换为整数；无法识别时返回 None"""
+    if text.isdecimal():
+        return int(text)
+    return parse(text)
@@ -0,0 +1,173 @@
+"""重命名计划的导出和导入（JSON Lines）
+
+计划可以在一台机器上生成、检查后再到别处执行。文件第一行是计划信息，
+之后每行一个条目：
+
+    {"format": "rename-plan", "version": 1, "folder": "/path/to/folder", "op": "extract"}
+    {"op": "rename", "source": "xx第1集.mp3", "target": "第1集.mp3", "size": 1024, "mtime_ns": ...}
+
+size 和 mtime_ns 是导出时源文件的状态。执行时逐条核对，文件已被移动或
+修改的条目视为过期并跳过。读写都是逐行进行的，执行时按 CHUNK_SIZE 条
+一批提交，内存占用与计划大小无关。
+"""
+import json
+import os
+
+import fsio
+import journal
+from engine import OperationResult, iter_batches
+
+FORMAT = 'rename-plan'
+VERSION = 1
+
+# 执行时每批的条目数，每批是一次事务（撤销信息合并保存，撤销时恢复整个计划）
+CHUNK_SIZE = 100000
+
+
+class PlanError(ValueError):
+    """计划文件无效"""
+
+
+def write_plan(path, folder, plan, op='rename'):
+    """逐条写出计划，返回条目数；plan 可以是生成器
+
+    先写入临时文件，完成后再替换，中途出错不会留下不完整的计划。
+    """
+    count = 0
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        header = {'format': FORMAT, 'version': VERSION, 'folder': os.path.abspath(folder), 'op': op}
+        f.write(json.dumps(header, ensure_ascii=False) + '\n')
+        for src, dst in plan:
+            stat = os.stat(os.path.join(folder, src))
+            entry = {'op': 'rename', 'source': src, 'target': dst,
+                     'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            count += 1
+    os.replace(temp_path, path)
+    return count
+
+
+def read_header(f, path):
+    try:
+        header = json.loads(f.readline())
+    except ValueError as e:
+        raise PlanError(f"{path} 不是重命名计划文件") from e
+    if not isinstance(header, dict) or header.get('format') != FORMAT:
+        raise PlanError(f"{path} 不是重命名计划文件")
+    if header.get('version') != VERSION:
+        raise PlanError(f"不支持的计划版本: {header.get('version')}")
+    return header
+
+
+def read_plan(path):
+    """返回 (计划信息, 条目生成器)，条目为 dict；文件无法打开时抛出 PlanError"""
+    try:
+        f = open(path, encoding='utf-8')
+    except OSError as e:
+        raise PlanError(f"无法打开计划文件 {path}: {e.strerror or e}") from e
+    try:
+        header = read_header(f, path)
+    except Exception:
+        f.close()
+        raise
+    return header, iter_entries(f, path)
+
+
+def iter_entries(f, path):
+    with f:
+        for number, line in enumerate(f, start=2):
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+                if entry['op'] != 'rename' or not entry['source'] or not entry['target']:
+                    raise ValueError(entry['op'])
+            except (ValueError, KeyError, TypeError) as e:
+                raise PlanError(f"{path} 第 {number} 行无效: {e}") from e
+            yield entry
+
+
+def check_entry(folder, entry, check_mtime=True):
+    """核对源文件状态，返回过期原因；仍然有效时返回 None"""
+    try:
+        stat = os.stat(os.path.join(folder, entry['source']))
+    except FileNotFoundError:
+        return "源文件不存在"
+    if 'size' in entry and stat.st_size != entry['size']:
+        return "文件大小已变化"
+    if check_mtime and 'mtime_ns' in entry and stat.st_mtime_ns != entry['mtime_ns']:
+        return "修改时间已变化"
+    return None
+
+
+def iter_valid(folder, entries, result, check_mtime=True, log=None):
+    """逐条核对，产出仍然有效的 (source, target)，过期条目计为跳过
+
+    核对按 fsio.workers 并发进行，产出顺序可能与计划文件不同。
+    """
+    checked = fsio.imap_unordered(lambda entry: (entry, check_entry(folder, entry, check_mtime)), entries)
+    for entry, reason in checked:
+        if reason is None:
+            yield entry['source'], entry['target']
+            continue
+        result.add_skipped()
+        if log is not None:
+            log(f"跳过 {entry['source']} → {entry['target']} ({reason})")
+
+
+def apply_plan(path, folder=None, progress=None, cancel=None, check_mtime=True,
+               log=None, chunk_size=CHUNK_SIZE):
+    """执行计划文件，返回 OperationResult（过期条目计入 skipped_count）
+
+    folder 默认为计划中记录的文件夹。每批内部按 journal.apply_renames 处理
+    链和循环；目标被后面批次的源文件占用的条目推迟到最后一起执行。各批的
+    撤销信息保存在一起，撤销时恢复整个计划。progress(done, total) 中的
+    total 为 None（条目总数未知）。
+    """
+    header, entries = read_plan(path)
+    folder = folder or header['folder']
+    if not os.path.isdir(folder):
+        entries.close()
+        raise NotADirectoryError(folder)
+
+    result = OperationResult()
+    deferred = []
+    done = 0
+    append_undo = False     # 前面的批次已保存撤销信息
+    try:
+        for chunk in iter_batches(iter_valid(folder, entries, result, check_mtime, log), chunk_size):
+            if cancel is not None and cancel.is_set():
+                result.cancelled = True
+                break
+            chunk_result = journal.apply_renames(
+                folder, chunk, offset_progress(progress, done), cancel, deferred, append_undo
+            )
+            merge(result, chunk_result)
+            append_undo = append_undo or bool(chunk_result.renamed)
+            done += len(chunk)
+            if result.cancelled:
+                break
+    finally:
+        entries.close()
+
+    if deferred and not result.cancelled:
+        merge(result, journal.apply_renames(
+            folder, deferred, offset_progress(progress, done), cancel, append_undo=append_undo
+        ))
+    return result
+
+
+def offset_progress(progress, offset):
+    """把一批内部的进度换算为整个计划的进度"""
+    if progress is None:
+        return None
+    return lambda done, total: progress(offset + done, None)
+
+
+def merge(total, result):
+    """把一批的结果计入总结果（不保留 renamed，避免随计划大小增长）"""
+    total.success_count += result.success_count
+    total.skipped_count += result.skipped_count
+    total.failed.extend(result.failed)
+    total.cancelled = total.cancelled or result.cancelled
@@ -0,0 +1,275 @@
+"""紧凑的计划存储
+
+百万行的计划保存为 (原文件名, 新文件名) 元组列表时，每行要一个元组和两个
+字符串对象，内存大部分花在对象头上。PlanStore 按列保存：
+
+- 文件夹名去重，每行只保存原文件和新文件的文件夹序号（array）；
+- 文件名和新文件名每 NameColumn.CHUNK 个拼接为一个字符串，另存结束位置；
+- 章/节/集保存为去重后的序号（bytearray），编号保存在 array('q') 中，没有
+  编号时为 NO_NUMBER；超出 64 位整数范围的编号（如“第12345678901234567890集”）
+  记为 BIG_NUMBER，实际值另存在字典中；
+- 集数排序键（engine.sort_key）在建立时为每行计算一次，排序结果保存为行号
+  数组。预览、缺失检查和执行重命名都按这个顺序读取，不再各自排序。
+
+行只在需要时才还原为 (原文件名, 新文件名)。
+"""
+import os
+from array import array
+
+import engine
+import rules
+
+NO_NUMBER = -1
+BIG_NUMBER = -2
+
+# array('q') 能保存的最大编号
+MAX_NUMBER = (1 << 63) - 1
+
+
+class NameColumn:
+    """紧凑的字符串列：每 CHUNK 个字符串拼接为一个，按结束位置切出"""
+
+    CHUNK = 4096
+
+    __slots__ = ('chunks', 'ends', 'pending', 'size')
+
+    def __init__(self):
+        self.chunks = []
+        self.ends = array('I')      # 每个字符串在所在块中的结束位置
+        self.pending = []           # 尚未拼接的最后一块
+        self.size = 0
+
+    def __len__(self):
+        return len(self.ends)
+
+    def append(self, text):
+        if self.pending is None:
+            self.reopen()
+        self.pending.append(text)
+        self.size += len(text)
+        self.ends.append(self.size)
+        if len(self.pending) == self.CHUNK:
+            self.chunks.append(''.join(self.pending))
+            self.pending = []
+            self.size = 0
+
+    def seal(self):
+        """拼接最后一块"""
+        if self.pending:
+            self.chunks.append(''.join(self.pending))
+        self.pending = None
+
+    def reopen(self):
+        """seal() 之后继续追加：把不满的最后一块重新拆开"""
+        self.pending = []
+        self.size = 0
+        count = len(self.ends) % self.CHUNK
+        if count:
+            last = self.chunks.pop()
+            for end in self.ends[-count:]:
+                self.pending.append(last[self.size:end])
+                self.size = end
+
+    def __getitem__(self, index):
+        chunk, offset = divmod(index, self.CHUNK)
+        if chunk == len(self.chunks):
+            return self.pending[offset]
+        start = self.ends[index - 1] if offset else 0
+        return self.chunks[chunk][start:self.ends[index]]
+
+
+class PlanStore:
+    """按列保存的文件和重命名计划，行按集数排序
+
+    可以只保存计划（from_plan），也可以保存文件夹中的全部文件（from_files），
+    此时不需要改名的文件只参与缺失检查。迭代、len() 和 window() 只涉及需要
+    改名的行，可直接作为计划传给 journal.apply_renames 等。
+    """
+
+    __slots__ = ('dirs', 'prefixes', 'dir_ids', 'dir_column', 'names', 'target_dir_column', 'targets',
+                 'kinds', 'kind_ids', 'kind_column', 'numbers', 'big_numbers', 'order', 'plan_order')
+
+    def __init__(self):
+        self.dirs = []
+        self.prefixes = []              # 文件夹加路径分隔符，拼接文件名用
+        self.dir_ids = {}
+        self.dir_column = array('I')
+        self.names = NameColumn()
+        self.target_dir_column = array('I')
+        self.targets = NameColumn()     # 只保存新文件名的文件名部分，不改名时为空
+        self.kinds = [None]
+        self.kind_ids = {None: 0}
+        self.kind_column = bytearray()
+        self.numbers = array('q')
+        self.big_numbers = {}           # 行号 -> 超出范围的编号
+        self.order = array('I')         # 全部行的排序结果
+        self.plan_order = array('I')    # 需要改名的行的排序结果
+
+    @classmethod
+    def from_plan(cls, plan):
+        """由 (原文件名, 新文件名) 建立"""
+        store = cls()
+        for source, target in plan:
+            store.add(source, target)
+        store.seal()
+        return store
+
+    @classmethod
+    def from_rows(cls, rows):
+        """由已解析的 (原文件名, 章/节/集, 编号, 新文件名) 建立（如文件夹索引中的记录），不再解析文件名"""
+        store = cls()
+        for source, kind, number, target in rows:
+            store.add_row(source, target, kind, number)
+        store.seal()
+        return store
+
+    @classmethod
+    def from_files(cls, files, transform):
+        """由文件列表建立，transform 计算新文件名，结果不变的文件不改名"""
+        store = cls()
+        for filename in files:
+            target = transform(filename)
+            store.add(filename, target if target != filename else None)
+        store.seal()
+        return store
+
+    def dir_id(self, folder):
+        dir_id = self.dir_ids.get(folder)
+        if dir_id is None:
+            dir_id = self.dir_ids[folder] = len(self.dirs)
+            self.dirs.append(folder)
+            self.prefixes.append(os.path.join(folder, '') if folder else '')
+        return dir_id
+
+    def add(self, source, target=None):
+        """追加一行，target 为 None 表示不改名"""
+        parsed = rules.DEFAULT_RULES.parse(source)
+        if parsed is None:
+            self.add_row(source, target, None, None)
+        else:
+            self.add_row(source, target, parsed.kind, parsed.number)
+
+    def add_row(self, source, target, kind, number):
+        """追加已解析编号的一行"""
+        folder, base = os.path.split(source)
+        dir_id = self.dir_id(folder)
+        if target is None:
+            target_dir_id, target_base = dir_id, ''
+        else:
+            target_folder, target_base = os.path.split(target)
+            target_dir_id = dir_id if target_folder == folder else self.dir_id(target_folder)
+
+        kind_id = self.kind_ids.get(kind)
+        if kind_id is None:
+            kind_id = self.kind_ids[kind] = len(self.kinds)
+            self.kinds.append(kind)
+
+        self.dir_column.append(dir_id)
+        self.names.append(base)
+        self.target_dir_column.append(target_dir_id)
+        self.targets.append(target_base)
+        self.kind_column.append(kind_id)
+        if number is None:
+            number = NO_NUMBER
+        elif number > MAX_NUMBER:
+            self.big_numbers[len(self.numbers)] = number
+            number = BIG_NUMBER
+        self.numbers.append(number)
+
+    def seal(self):
+        """结束追加，按集数排序"""
+        self.names.seal()
+        self.targets.seal()
+        folder_keys = [engine.natural_key(folder) for folder in self.dirs]
+        keys = [
+            engine.sort_key(folder_keys[self.dir_column[index]], self.names[index],
+                            self.kinds[self.kind_column[index]], self.number(index))
+            for index in range(len(self.names))
+        ]
+        self.order = array('I', sorted(range(len(keys)), key=keys.__getitem__))
+        self.plan_order = array('I', (index for index in self.order if self.targets[index]))
+
+    def update(self, renamed, transform, recheck=None):
+        """按重命名结果更新计划，只处理发生变化的行
+
+        renamed 为实际生效的 (原文件名, 新文件名)，原文件名的行删除。与计划一致
+        的改名已经完成（改名结果再经 transform 不会变化）；其余改名（如撤销）的
+        新文件名按 transform 重新计算，仍需改名时加入计划。recheck 为函数时，对
+        计划中未被改名的行调用 recheck(原文件名)，返回假的行删除，如源文件已
+        不存在。
+
+        用于计划（from_plan/from_rows 建立）。删除的行只从顺序中去掉（列中的
+        数据保留），只为新增的行计算排序键，再二分插入到原有顺序中。
+        """
+        moved = dict(renamed)
+        kept = array('I')
+        for index in self.plan_order:
+            source = self.source(index)
+            if source in moved:
+                if moved[source] == self.target(index):
+                    del moved[source]
+                continue
+            if recheck is not None and not recheck(source):
+                continue
+            kept.append(index)
+
+        start = len(self.names)
+        for source, target in engine.iter_plan(moved.values(), transform):
+            self.add(source, target)
+        self.names.seal()
+        self.targets.seal()
+
+        merged = array('I')
+        copied = 0
+        for index in sorted(range(start, len(self.names)), key=self.row_key):
+            key = self.row_key(index)
+            low, high = copied, len(kept)
+            while low < high:
+                middle = (low + high) // 2
+                if key < self.row_key(kept[middle]):
+                    high = middle
+                else:
+                    low = middle + 1
+            merged.extend(kept[copied:low])
+            merged.append(index)
+            copied = low
+        merged.extend(kept[copied:])
+        self.order = self.plan_order = merged
+
+    def row_key(self, index):
+        """第 index 行的排序键（engine.sort_key）"""
+        return engine.sort_key(engine.natural_key(self.dirs[self.dir_column[index]]), self.names[index],
+                               self.kinds[self.kind_column[index]], self.number(index))
+
+    def number(self, index):
+        number = self.numbers[index]
+        if number >= 0:
+            return number
+        return self.big_numbers[index] if number == BIG_NUMBER else None
+
+    def source(self, index):
+        return self.prefixes[self.dir_column[index]] + self.names[index]
+
+    def target(self, index):
+        base = self.targets[index]
+        if not base:
+            return None
+        return self.prefixes[self.target_dir_column[index]] + base
+
+    def __len__(self):
+        return len(self.plan_order)
+
+    def __iter__(self):
+        """按集数顺序产出需要改名的 (原文件名, 新文件名)"""
+        for index in self.plan_order:
+            yield self.source(index), self.target(index)
+
+    def window(self, start, count):
+        """按顺序取出从 start 开始的 count 行计划"""
+        return [(self.source(index), self.target(index)) for index in self.plan_order[start:start + count]]
+
+    def episode_entries(self):
+        """带编号的全部文件 (文件名, 章/节/集, 编号)，按顺序产出，供 engine.check_episodes 使用"""
+        for index in self.order:
+            if self.numbers[index] != NO_NUMBER:
+                yield self.source(index), self.kinds[self.kind_column[index]], self.number(index)
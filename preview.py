@@ -0,0 +1,137 @@
+"""虚拟化预览表格
+
+重命名计划保存在 Python 端的 PreviewModel 中，Treeview 只保留可见区域内的
+若干行并在滚动时复用，因此打开和刷新的耗时与文件夹大小无关。
+"""
+import tkinter as tk
+from tkinter import ttk
+
+from planstore import PlanStore
+
+
+class PreviewModel:
+    """预览数据：按集数排序的计划（planstore.PlanStore），以及生成它的文件夹和改名函数
+
+    rows 可以直接作为计划迭代，执行重命名、导出计划时不再复制一份列表。
+    """
+
+    def __init__(self):
+        self.rows = PlanStore.from_plan(())
+        self.folder = None
+        self.transform = None
+
+    def __len__(self):
+        return len(self.rows)
+
+    def set_rows(self, rows, folder=None, transform=None):
+        self.rows = rows if isinstance(rows, PlanStore) else PlanStore.from_plan(rows)
+        self.folder = folder
+        self.transform = transform
+
+    def clear(self):
+        self.set_rows(())
+
+    def apply_renames(self, renamed, recheck=None):
+        """按重命名结果只更新受影响的行，用法同 PlanStore.update"""
+        self.rows.update(renamed, self.transform, recheck)
+
+    def window(self, start, count):
+        """取出从 start 开始的 count 行"""
+        return self.rows.window(start, count)
+
+
+class VirtualPreview(ttk.Frame):
+    """只渲染可见行的双列预览表格"""
+
+    def __init__(self, parent, model, columns, row_height):
+        super().__init__(parent)
+        self.model = model
+        self.row_height = row_height
+        self.first = 0
+        self.visible = 0
+
+        style = ttk.Style()
+        style.configure('Preview.Treeview', rowheight=row_height)
+
+        self.tree = ttk.Treeview(self, columns=[key for key, _, _ in columns],
+                                 show='headings', style='Preview.Treeview', selectmode='none')
+        for key, text, width in columns:
+            self.tree.heading(key, text=text)
+            self.tree.column(key, width=width, anchor='w')
+
+        # 滚动条由模型驱动，而不是由Treeview自身驱动
+        self.scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.on_scrollbar)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        self.tree.bind('<Configure>', self.on_resize)
+        for sequence in ('<MouseWheel>', '<Button-4>', '<Button-5>'):
+            self.tree.bind(sequence, self.on_wheel)
+
+    def refresh(self, reset=True):
+        """模型变化后重新渲染可见区域，reset 为假时尽量保持滚动位置"""
+        if reset:
+            self.first = 0
+        else:
+            self.first = max(0, min(self.first, len(self.model) - self.page_size()))
+        self.render()
+
+    def page_size(self):
+        """可完整显示的行数（扣除表头一行）"""
+        return max(1, self.visible - 1)
+
+    def scroll_to(self, first):
+        last_first = max(0, len(self.model) - self.page_size())
+        first = max(0, min(int(first), last_first))
+        if first != self.first:
+            self.first = first
+            self.render()
+
+    def render(self):
+        """把模型中可见的若干行填入复用的Treeview行"""
+        rows = self.model.window(self.first, self.visible)
+        items = self.tree.get_children()
+        for index, item in enumerate(items):
+            if index < len(rows):
+                self.tree.item(item, values=rows[index])
+            else:
+                self.tree.item(item, values=('', ''))
+
+        total = len(self.model)
+        if total:
+            self.scrollbar.set(self.first / total, min(1.0, (self.first + self.page_size()) / total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def on_resize(self, event):
+        """窗口尺寸变化时调整复用行的数量"""
+        visible = max(1, event.height // self.row_height)
+        if visible == self.visible:
+            return
+
+        items = self.tree.get_children()
+        if visible > len(items):
+            for _ in range(visible - len(items)):
+                self.tree.insert('', 'end', values=('', ''))
+        else:
+            self.tree.delete(*items[visible:])
+
+        self.visible = visible
+        self.scroll_to(self.first)
+        self.render()
+
+    def on_scrollbar(self, action, amount, unit=None):
+        """处理滚动条拖动和点击"""
+        if action == 'moveto':
+            self.scroll_to(float(amount) * len(self.model))
+        elif action == 'scroll':
+            step = self.page_size() if unit == 'pages' else 1
+            self.scroll_to(self.first + int(amount) * step)
+
+    def on_wheel(self, event):
+        """处理鼠标滚轮，阻止Treeview自身滚动"""
+        if event.num == 4 or event.delta > 0:
+            self.scroll_to(self.first - 3)
+        else:
+            self.scroll_to(self.first + 3)
+        return 'break'
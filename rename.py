@@ -1,14 +1,31 @@
 import os
-import re
+import sys
+
+# 带参数运行时使用命令行模式，不加载图形界面相关模块
+if __name__ == "__main__" and len(sys.argv) > 1:
+    if getattr(sys, 'frozen', False):
+        # 打包为EXE时并行同步的子进程也从这里进入
+        import multiprocessing
+        multiprocessing.freeze_support()
+    
+    import cli
+    sys.exit(cli.main())
+
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
 import ctypes
 import platform
-from mutagen.easyid3 import EasyID3
-from mutagen.mp3 import MP3
-from mutagen.mp4 import MP4
-from mutagen.id3 import TPE1, TIT2
-from mutagen.flac import FLAC
+import sqlite3
+
+import engine
+import fsio
+import instrument
+import journal
+import planfile
+from index import FolderIndex
+from planstore import PlanStore
+from preview import PreviewModel, VirtualPreview
+from worker import BackgroundTask
 
 class FileRenamerApp:
     def __init__(self, root):
@@ -29,6 +46,12 @@ class FileRenamerApp:
         # 主界面布局
         self.setup_ui()
         
+        # 设置环境变量 RENAME_PROFILE 时记录各阶段耗时
+        self.profile_path = instrument.enable_from_env()
+        
+        # 设置环境变量 RENAME_IO_WORKERS 时并发执行文件系统操作（网络共享）
+        fsio.workers_from_env()
+        
     def setup_dpi_awareness(self):
         """设置DPI感知"""
         if platform.system() == "Windows":
@@ -130,6 +153,10 @@ class FileRenamerApp:
         
         # 操作按钮
         self.setup_action_buttons(left_frame, current_row)
+        current_row += 1
+        
+        # 进度显示
+        self.setup_progress_area(left_frame, current_row)
         
         # 添加软件使用说明
         self.setup_usage_instructions(right_frame)
@@ -147,6 +174,12 @@ class FileRenamerApp:
         entry.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=self.scaled(5))
         
         ttk.Button(frame, text="浏览...", command=self.select_folder).pack(side=tk.RIGHT)
+        
+        self.recursive = tk.BooleanVar(value=False)
+        ttk.Checkbutton(frame, text="包含子文件夹", variable=self.recursive).pack(side=tk.RIGHT, padx=self.scaled(5))
+        
+        self.retag = tk.BooleanVar(value=False)
+        ttk.Checkbutton(frame, text="重命名时同步音频标题", variable=self.retag).pack(side=tk.RIGHT, padx=self.scaled(5))
     
     def setup_function_buttons(self, parent, row):
         """功能按钮"""
@@ -157,7 +190,9 @@ class FileRenamerApp:
             ("提取章节信息", self.extract_chapter_info),
             ("统一编号格式", self.unify_number_format),
             ("检查缺失集数", self.check_missing_episodes),
-            ("同步音频标题", self.sync_audio_titles)
+            ("同步音频标题", self.sync_audio_titles),
+            ("检查重复文件", self.check_duplicates),
+            ("批量处理书库", self.process_library)
         ]
         
         for i, (text, command) in enumerate(buttons):
@@ -174,22 +209,18 @@ class FileRenamerApp:
         frame = ttk.LabelFrame(parent, text="文件预览 (原文件名 → 新文件名)")
         frame.grid(row=row, column=0, sticky="nsew", pady=(0, self.scaled(5)))
         
-        # 使用Treeview组件实现双列显示
-        self.preview_tree = ttk.Treeview(frame, columns=('original', 'new'), show='headings', height=10)
-        self.preview_tree.pack(fill=tk.BOTH, expand=True)
-        
-        # 设置列标题
-        self.preview_tree.heading('original', text='原文件名')
-        self.preview_tree.heading('new', text='新文件名')
-        
-        # 设置列宽
-        self.preview_tree.column('original', width=self.scaled(200), anchor='w')
-        self.preview_tree.column('new', width=self.scaled(200), anchor='w')
-        
-        # 添加滚动条
-        #scrollbar = ttk.Scrollbar(frame, orient="vertical", command=self.preview_tree.yview)
-        #scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        #self.preview_tree.configure(yscrollcommand=scrollbar.set)
+        # 预览数据保存在模型中，表格只渲染可见行（带滚动条）
+        self.preview_model = PreviewModel()
+        self.preview_table = VirtualPreview(
+            frame,
+            self.preview_model,
+            columns=[
+                ('original', '原文件名', self.scaled(200)),
+                ('new', '新文件名', self.scaled(200))
+            ],
+            row_height=self.scaled(24)
+        )
+        self.preview_table.pack(fill=tk.BOTH, expand=True)
     
     def setup_action_buttons(self, parent, row):
         """操作按钮"""
@@ -199,12 +230,31 @@ class FileRenamerApp:
         buttons = [
             ("预览更改", self.preview_changes),
             ("执行重命名", self.execute_rename),
+            ("撤销重命名", self.undo_rename),
+            ("导出计划", self.export_plan),
+            ("导入计划", self.import_plan),
             ("退出", self.root.quit)
         ]
         
         for text, command in buttons:
             ttk.Button(frame, text=text, command=command).pack(side=tk.LEFT, padx=self.scaled(5), expand=True)
     
+    def setup_progress_area(self, parent, row):
+        """进度条和取消按钮"""
+        frame = ttk.Frame(parent)
+        frame.grid(row=row, column=0, sticky="ew", pady=(self.scaled(5), 0))
+        
+        self.task = None
+        
+        self.progress_bar = ttk.Progressbar(frame, mode='determinate')
+        self.progress_bar.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=self.scaled(5))
+        
+        self.cancel_button = ttk.Button(frame, text="取消", command=self.cancel_task, state='disabled')
+        self.cancel_button.pack(side=tk.RIGHT, padx=self.scaled(5))
+        
+        self.progress_label = ttk.Label(frame, text="就绪", font=('Microsoft YaHei', 10))
+        self.progress_label.pack(side=tk.RIGHT, padx=self.scaled(5))
+    
     def setup_usage_instructions(self, parent):
         """添加软件使用说明"""
         #动态拉伸
@@ -242,28 +292,43 @@ class FileRenamerApp:
    - 将编号统一为4位数
    - 例如：第1集 → 第0001集
    - 第100集 → 第0100集
+   - 中文编号同样转换：第一百二十三集 → 第0123集
 
 3. 检查缺失集数：
    - 自动检测文件编号连续性
-   - 弹出窗口显示缺失的集数
-   - 支持章/节/集多种格式
+   - 弹出窗口显示缺失的集数，连续缺失按区间显示（如 第12–47集）
+   - 同时列出重复编号和明显异常的编号（如 第20240101集），按章/节/集分别统计
+   - 支持章/节/集多种格式，以及中文编号（一百二十三、两千、壹佰等）
 
 4. 同步音频标题：
    - 将MP3/M4A/FLAC文件名同步到音频元数据
    - 仅修改标题，不影响其他元数据
+   - 文件较多时使用多个进程并行写入，进程数默认为CPU核心数，可用环境变量 RENAME_SYNC_WORKERS 指定
    - 需要安装mutagen库
 
+5. 检查重复文件：
+   - 找出同一集内容相同的多个副本（文件名不同，整理后会重名）
+   - 先按编号和文件大小筛选，再比较开头和结尾，必要时比较全部内容，只读取很少的数据
+   - 列出建议保留的副本（文件名已整理、较短、较早下载的优先）
+
+6. 批量处理书库：
+   - 选择书库根目录，自动找出所有包含带编号文件的文件夹
+   - 每个文件夹分别提取章节信息、统一编号格式并检查缺失集数（勾选“重命名时同步音频标题”时同时同步标题）
+   - 多个文件夹同时处理，大文件夹不会拖住小文件夹
+   - 每个文件夹的结果逐行写入报告文件（JSON Lines），处理过程中即可查看
+
 【操作步骤】
 
 1. 选择目标文件夹
 2. 点击相应功能按钮
 3. 预览更改效果
 4. 确认无误后执行重命名
+5. 如需恢复，点击“撤销重命名”
 
 【注意事项】
 
 • 操作前建议备份重要文件
-• 重命名操作不可逆
+• 可撤销最近一次重命名
 • 音频功能需要mutagen库
 • 高分辨率屏幕自动适配
 """
@@ -309,50 +374,99 @@ class FileRenamerApp:
         
         self.instructions.config(state='disabled')
     
+    def run_in_background(self, target, on_done):
+        """在后台线程执行耗时操作，完成后在主线程调用 on_done(result)"""
+        if self.task is not None and self.task.running:
+            messagebox.showwarning("警告", "已有操作正在进行，请等待完成或取消")
+            return
+        
+        self.progress_bar.configure(value=0, maximum=1)
+        self.progress_label.config(text="正在处理...")
+        self.cancel_button.state(['!disabled'])
+        
+        self.task = BackgroundTask(
+            self.root,
+            target,
+            on_progress=self.update_progress,
+            on_done=lambda result, error: self.finish_background(on_done, result, error)
+        )
+        self.task.start()
+    
+    def update_progress(self, progress):
+        """更新进度条"""
+        if progress.total:
+            self.progress_bar.configure(maximum=progress.total, value=progress.done)
+        self.progress_label.config(text=progress.describe())
+    
+    def cancel_task(self):
+        """取消正在进行的操作"""
+        if self.task is not None and self.task.running:
+            self.task.cancel()
+            self.progress_label.config(text="正在取消...")
+    
+    def finish_background(self, on_done, result, error):
+        """后台操作结束"""
+        self.task = None
+        self.cancel_button.state(['disabled'])
+        
+        if error is not None:
+            self.progress_label.config(text="出错")
+            messagebox.showerror(
+                "意外错误",
+                f"发生未预期的错误:\n\n{type(error).__name__}: {str(error)}"
+            )
+            return
+        
+        self.progress_label.config(text="已取消" if result.cancelled else "完成")
+        on_done(result)
+    
     def select_folder(self):
         """选择文件夹"""
         folder = filedialog.askdirectory()
         if folder:
             self.folder_path.set(folder)
     
-    def get_files(self):
-        """获取文件夹中的文件列表"""
+    def get_folder(self):
+        """获取当前文件夹，无效时提示并返回 None"""
         folder = self.folder_path.get()
         if not folder or not os.path.isdir(folder):
             messagebox.showwarning("警告", "请先选择有效文件夹")
             return None
-        
-        return [f for f in os.listdir(folder) if os.path.isfile(os.path.join(folder, f))]
+        return folder
+    
+    def query_folder(self, folder, query, fallback, quick=True):
+        """优先通过文件夹索引查询，索引不可用时直接扫描文件夹；quick 的用法同 FolderIndex.refresh"""
+        recursive = self.recursive.get()
+        try:
+            with FolderIndex(folder) as folder_index:
+                folder_index.refresh(recursive, quick)
+                return query(folder_index, recursive)
+        except (sqlite3.Error, OSError):
+            return fallback(engine.iter_files(folder, recursive))
     
     def clear_preview(self):
         """清空预览区域"""
-        for item in self.preview_tree.get_children():
-            self.preview_tree.delete(item)
+        self.preview_model.clear()
+        self.preview_table.refresh()
+    
+    def show_plan(self, plan, folder, transform):
+        """在预览区域显示重命名计划，transform 为生成计划的改名函数（用于增量刷新）"""
+        self.preview_model.set_rows(plan, folder, transform)
+        self.preview_table.refresh()
     
     def preview_changes(self):
         """预览更改"""
-        files = self.get_files()
-        if files is None:
+        folder = self.get_folder()
+        if folder is None:
             return
         
-        self.clear_preview()
-        
-        for filename in sorted(files):
-            new_name = self.process_filename(filename)
-            if new_name != filename:
-                self.preview_tree.insert('', 'end', values=(filename, new_name))
-    
-    def process_filename(self, filename):
-        """处理文件名"""
-        # 提取基本名称和扩展名
-        basename, ext = os.path.splitext(filename)
-        
-        # 尝试匹配章/节/集
-        match = re.search(r'(第[零一二三四五六七八九十百千万\d]+[章节集])', basename)
-        if match:
-            return match.group(1) + ext
-        
-        return filename
+        self.show_plan(self.query_folder(
+            folder,
+            lambda folder_index, recursive: folder_index.plan_extract(recursive),
+            lambda files: PlanStore.from_plan(engine.iter_plan(
+                files, instrument.wrap('process_filename', engine.process_filename)
+            ))
+        ), folder, engine.process_filename)
     
     def extract_chapter_info(self):
         """提取章节信息"""
@@ -360,54 +474,35 @@ class FileRenamerApp:
     
     def unify_number_format(self):
         """统一编号格式"""
-        files = self.get_files()
-        if files is None:
+        folder = self.get_folder()
+        if folder is None:
             return
         
-        self.clear_preview()
-        
-        for filename in sorted(files):
-            basename, ext = os.path.splitext(filename)
-            
-            # 匹配数字编号
-            match = re.search(r'(第)(\d+)([章节集])', basename)
-            if match:
-                prefix = match.group(1)
-                number = match.group(2).zfill(4)  # 补齐4位
-                suffix = match.group(3)
-                new_name = f"{prefix}{number}{suffix}{ext}"
-                self.preview_tree.insert('', 'end', values=(filename, new_name))
-            else:
-                # 如果不是数字编号，保持原样
-                self.preview_tree.insert('', 'end', values=(filename, filename))
+        self.show_plan(self.query_folder(
+            folder,
+            lambda folder_index, recursive: folder_index.plan_unify(recursive),
+            lambda files: PlanStore.from_plan(engine.iter_plan(
+                files, instrument.wrap('unify_filename', engine.unify_filename)
+            ))
+        ), folder, engine.unify_filename)
     
     def check_missing_episodes(self):
         """检查缺失集数"""
-        files = self.get_files()
-        if files is None:
+        folder = self.get_folder()
+        if folder is None:
             return
         
-        numbers = set()
-        
-        for filename in files:
-            basename = os.path.splitext(filename)[0]
-            
-            # 匹配数字编号
-            match = re.search(r'第(\d+)[章节集]', basename)
-            if match:
-                numbers.add(int(match.group(1)))
-        
-        if not numbers:
+        report = self.query_folder(
+            folder,
+            lambda folder_index, recursive: folder_index.find_missing(recursive),
+            engine.find_missing
+        )
+        if not report:
             messagebox.showinfo("检查结果", "没有找到带编号的文件")
             return
         
-        min_num = min(numbers)
-        max_num = max(numbers)
-        full_set = set(range(min_num, max_num + 1))
-        missing = sorted(full_set - numbers)
-        
-        if not missing:
-            messagebox.showinfo("检查结果", f"编号从{min_num}到{max_num}，没有缺失")
+        if all(group.complete for group in report):
+            messagebox.showinfo("检查结果", engine.format_episode_report(report) + "\n\n没有缺失")
         else:
             # 创建弹出窗口显示缺失章节
             dialog = tk.Toplevel(self.root)
@@ -419,9 +514,12 @@ class FileRenamerApp:
             main_frame.pack(fill=tk.BOTH, expand=True, padx=self.scaled(10), pady=self.scaled(10))
             
             # 标题
+            missing_count = sum(group.missing_count for group in report)
+            duplicate_count = sum(len(group.duplicates) for group in report)
+            outlier_count = sum(len(group.outliers) for group in report)
             ttk.Label(
                 main_frame, 
-                text=f"共缺失 {len(missing)} 集 (编号{min_num}-{max_num})", 
+                text=f"共缺失 {missing_count} 个，重复 {duplicate_count} 个，异常编号 {outlier_count} 个", 
                 font=('Microsoft YaHei', 10, 'bold')
             ).pack(pady=(0, self.scaled(10)))
             
@@ -443,8 +541,8 @@ class FileRenamerApp:
             text.pack(fill=tk.BOTH, expand=True)
             scrollbar.config(command=text.yview)
             
-            # 添加缺失章节
-            text.insert(tk.END, "\n".join([f"第{n}集" for n in missing]))
+            # 添加缺失章节（按区间）
+            text.insert(tk.END, engine.format_episode_report(report))
             text.config(state='disabled')
             
             # 关闭按钮
@@ -454,6 +552,75 @@ class FileRenamerApp:
                 command=dialog.destroy
             ).pack(pady=(self.scaled(10), 0))
     
+    def check_duplicates(self):
+        """检查内容相同的重复集数，列出建议保留的副本"""
+        folder = self.get_folder()
+        if folder is None:
+            return
+        
+        import duplicates
+        
+        def find(progress, cancel):
+            entries = self.query_folder(
+                folder,
+                lambda folder_index, recursive: folder_index.duplicate_entries(recursive),
+                lambda files: duplicates.scan_entries(folder, files),
+                quick=False
+            )
+            return duplicates.find_duplicates(folder, entries, cancel=cancel)
+        
+        self.run_in_background(
+            find,
+            lambda report: self.show_result_dialog("重复文件", duplicates.format_duplicate_report(report))
+        )
+    
+    def process_library(self):
+        """对书库中的每个系列文件夹提取章节信息、统一编号并检查缺失，结果写入报告文件"""
+        root = filedialog.askdirectory(title="选择书库根目录")
+        if not root:
+            return
+        
+        operations = ['extract', 'unify', 'missing']
+        if self.retag.get():
+            try:
+                import tags
+            except ImportError as e:
+                messagebox.showerror("错误", f"音频元数据功能需要安装mutagen库:\npip install mutagen\n\n{e}")
+                return
+            operations.append('tags')
+        
+        report_path = filedialog.asksaveasfilename(
+            title="保存处理报告",
+            initialfile="rename-report.jsonl",
+            defaultextension=".jsonl",
+            filetypes=[("处理报告", "*.jsonl"), ("所有文件", "*.*")]
+        )
+        if not report_path:
+            return
+        
+        confirm = messagebox.askyesno(
+            "确认批量处理",
+            f"将处理以下目录中所有包含带编号文件的文件夹:\n{root}\n\n"
+            "每个文件夹分别提取章节信息、统一编号格式并检查缺失集数"
+            f"{'、同步音频标题' if 'tags' in operations else ''}\n"
+            "每个文件夹可单独撤销最近一次重命名\n\n"
+            "确定要继续吗?"
+        )
+        if not confirm:
+            return
+        
+        import batch
+        
+        self.run_in_background(
+            lambda progress, cancel: batch.run_batch(
+                root, operations, apply=True, report_path=report_path, progress=progress, cancel=cancel
+            ),
+            lambda result: self.show_result_dialog(
+                "批量处理结果",
+                batch.format_batch_summary(result) + f"\n\n各文件夹的详细结果已保存到:\n{report_path}"
+            )
+        )
+    
     def sync_audio_titles(self):
         """同步音频标题（优化版）"""
         folder = self.folder_path.get()
@@ -462,13 +629,9 @@ class FileRenamerApp:
             return
 
         try:
-            # 支持的音频文件扩展名
-            supported_ext = {'.mp3', '.m4a', '.flac'}  # 添加了FLAC支持
-            audio_files = [
-                f for f in os.listdir(folder) 
-                if os.path.splitext(f)[1].lower() in supported_ext
-                and os.path.isfile(os.path.join(folder, f))
-            ]
+            import tags
+            
+            audio_files = tags.list_audio_files(folder, self.recursive.get())
             
             if not audio_files:
                 messagebox.showwarning("警告", "没有找到支持的音频文件(支持MP3/M4A/FLAC)")
@@ -487,80 +650,32 @@ class FileRenamerApp:
             if not confirm:
                 return
             
-            success_count = 0
-            failed_files = []
+            recursive = self.recursive.get()
             
-            for filename in audio_files:
+            def sync(progress, cancel):
+                # 索引跳过上次同步后未变化的文件；索引不可用时逐个读取标签比较
+                folder_index = None
                 try:
-                    filepath = os.path.join(folder, filename)
-                    basename = os.path.splitext(filename)[0]
-                    ext = os.path.splitext(filename)[1].lower()
-                    
-                    if ext == '.mp3':
-                        # MP3文件处理（使用ID3v2.4标准）
-                        audio = MP3(filepath)
-                        
-                        # 确保标签存在
-                        if audio.tags is None:
-                            audio.add_tags(ID3=ID3)
-                        
-                        # 删除旧标题和艺术家标签（如果存在）
-                        for tag in ['TIT2', 'TPE1']:
-                            if tag in audio.tags:
-                                del audio.tags[tag]
-                        
-                        # 添加新标签（UTF-8编码）
-                        audio.tags.add(TIT2(encoding=3, text=basename))  # 标题
-                        audio.tags.add(TPE1(encoding=3, text=basename))  # 艺术家
-                        
-                        # 强制保存为ID3v2.4
-                        audio.tags.save(filepath, v2_version=4)
-                        
-                    elif ext == '.m4a':
-                        # M4A文件处理
-                        audio = MP4(filepath)
-                        
-                        # 确保标签存在
-                        if audio.tags is None:
-                            audio.add_tags()
-                        
-                        # 设置标题标签
-                        audio.tags["\xa9nam"] = [basename]  # 标题（注意这里是列表）
-                        audio.tags["\xa9ART"] = [basename]  # 艺术家（可选）
-                        audio.save()
-                    
-                    elif ext == '.flac':
-                        # FLAC文件处理
-                        audio = FLAC(filepath)
-                        
-                        # 确保标签存在
-                        if not audio.tags:
-                            audio.add_tags()
-                        
-                        # 设置标题标签
-                        audio.tags["TITLE"] = basename
-                        audio.save()
-                    
-                    success_count += 1
-                    
-                except Exception as e:
-                    # 获取更详细的错误信息
-                    error_detail = f"{type(e).__name__}: {str(e)}"
-                    failed_files.append(f"{filename} ({error_detail})")
-            
-            # 更友好的结果展示
-            result_msg = [
-                f"操作完成:",
-                f"✓ 成功处理: {success_count} 个文件",
-                f"✗ 处理失败: {len(failed_files)} 个文件"
-            ]
-            
-            if failed_files:
-                result_msg.append("\n失败详情:")
-                result_msg.extend(failed_files)
+                    try:
+                        folder_index = FolderIndex(folder)
+                        folder_index.refresh(recursive, quick=False)
+                    except (sqlite3.Error, OSError):
+                        if folder_index is not None:
+                            folder_index.close()
+                            folder_index = None
+                    return tags.sync_audio_titles(
+                        folder, audio_files, progress, cancel,
+                        workers=tags.default_workers(len(audio_files)), index=folder_index
+                    )
+                finally:
+                    if folder_index is not None:
+                        folder_index.close()
             
-            # 使用ScrolledText显示可能的长结果
-            self.show_result_dialog("同步结果", "\n".join(result_msg))
+            # 在后台执行，完成后使用ScrolledText显示可能的长结果
+            self.run_in_background(
+                sync,
+                lambda result: self.show_result_dialog("同步结果", tags.format_sync_report(result))
+            )
             
         except ImportError as e:
             messagebox.showwarning(
@@ -576,8 +691,25 @@ class FileRenamerApp:
                 f"发生未预期的错误:\n\n{type(e).__name__}: {str(e)}"
             )
 
+    def profile_report(self):
+        """上次报告以来的耗时统计（未开启时为空），同时导出到 RENAME_PROFILE 指定的文件"""
+        if not instrument.enabled:
+            return ""
+        
+        report = "\n\n耗时统计:\n" + instrument.format_summary()
+        if self.profile_path:
+            try:
+                instrument.export_summary(self.profile_path)
+                instrument.export_trace(os.path.splitext(self.profile_path)[0] + ".trace.json")
+                report += f"\n\n已保存到 {self.profile_path}"
+            except OSError as e:
+                report += f"\n\n保存耗时统计失败: {str(e)}"
+        instrument.reset()
+        return report
+    
     def show_result_dialog(self, title, message):
         """显示带滚动条的结果对话框"""
+        message += self.profile_report()
         dialog = tk.Toplevel(self.root)
         dialog.title(title)
         dialog.geometry(f"{self.scaled(600)}x{self.scaled(400)}")
@@ -614,61 +746,239 @@ class FileRenamerApp:
     
     def execute_rename(self):
         """执行重命名"""
+        folder = self.folder_path.get()
+        if not folder or not os.path.isdir(folder):
+            messagebox.showwarning("警告", "请先选择有效文件夹")
+            return
+        
+        # 上次重命名中断时，先继续执行或回滚
+        if journal.pending_journal(folder):
+            self.recover_rename(folder)
+            return
+        
         # 获取预览中的所有项目
-        items = self.preview_tree.get_children()
-        if not items:
+        plan = self.preview_model.rows
+        if not plan:
             messagebox.showwarning("警告", "没有可执行的重命名操作")
             return
         
+        # 多个文件改成同一个名字时，通常是同一集下载了多次
+        targets = set()
+        collisions = 0
+        for _, new_name in plan:
+            if new_name in targets:
+                collisions += 1
+            targets.add(new_name)
+        hint = f"其中 {collisions} 个与其他文件的目标文件名相同，可先“检查重复文件”\n" if collisions else ""
+        
+        # 确认对话框
+        confirm = messagebox.askyesno(
+            "确认重命名",
+            f"即将重命名 {len(plan)} 个文件\n"
+            f"{hint}"
+            "完成后可通过“撤销重命名”恢复\n\n"
+            "确定要继续吗?"
+        )
+        
+        if not confirm:
+            return
+        
+        if not self.retag.get():
+            self.run_in_background(
+                lambda progress, cancel: journal.apply_renames(folder, plan, progress, cancel),
+                lambda result: self.finish_rename(result, recheck=True)
+            )
+            return
+        
+        try:
+            import tags
+        except ImportError as e:
+            messagebox.showerror("错误", f"音频元数据功能需要安装mutagen库:\npip install mutagen\n\n{e}")
+            return
+        import normalize
+        
+        # 改名的同时写入标题，每个文件只处理一次；不需要改名的音频文件也同步标题
+        recursive = self.recursive.get()
+        tag_results = []
+        def rename_and_tag(progress, cancel):
+            moving = {src for src, _ in plan}
+            unchanged = [
+                name for name in engine.iter_files(folder, recursive)
+                if name not in moving and os.path.splitext(name)[1].lower() in tags.AUDIO_EXTENSIONS
+            ]
+            result, tag_result = normalize.rename_and_tag(folder, plan, unchanged, progress, cancel)
+            tag_results.append(tag_result)
+            return result
+        
+        self.run_in_background(
+            rename_and_tag,
+            lambda result: self.finish_rename(result, tags.format_sync_report(tag_results[0]), recheck=True)
+        )
+    
+    def export_plan(self):
+        """把预览中的计划导出为 JSON Lines 文件"""
+        folder = self.get_folder()
+        if folder is None:
+            return
+        
+        plan = self.preview_model.rows
+        if not plan:
+            messagebox.showwarning("警告", "没有可导出的重命名操作")
+            return
+        
+        path = filedialog.asksaveasfilename(
+            defaultextension=".jsonl",
+            filetypes=[("重命名计划", "*.jsonl"), ("所有文件", "*.*")]
+        )
+        if not path:
+            return
+        
+        try:
+            count = planfile.write_plan(path, folder, plan)
+        except OSError as e:
+            messagebox.showerror("错误", f"导出计划失败:\n{e}")
+            return
+        messagebox.showinfo("导出计划", f"已导出 {count} 个条目到:\n{path}")
+    
+    def import_plan(self):
+        """执行导出的计划文件（逐条读取，不载入预览）"""
+        path = filedialog.askopenfilename(
+            filetypes=[("重命名计划", "*.jsonl"), ("所有文件", "*.*")]
+        )
+        if not path:
+            return
+        
+        try:
+            header, entries = planfile.read_plan(path)
+            entries.close()
+        except (OSError, planfile.PlanError) as e:
+            messagebox.showerror("错误", f"无法读取计划:\n{e}")
+            return
+        
+        folder = header['folder']
+        if not os.path.isdir(folder):
+            # 计划在其他机器上生成时，由用户指定文件夹
+            messagebox.showinfo("导入计划", f"计划中的文件夹不存在:\n{folder}\n\n请选择要执行计划的文件夹")
+            folder = filedialog.askdirectory()
+            if not folder:
+                return
+        
+        if journal.pending_journal(folder):
+            self.recover_rename(folder)
+            return
+        
+        confirm = messagebox.askyesno(
+            "确认执行计划",
+            f"将在以下文件夹执行计划:\n{folder}\n\n"
+            "已被移动或修改的文件会跳过\n\n"
+            "确定要继续吗?"
+        )
+        if not confirm:
+            return
+        
+        self.folder_path.set(folder)
+        self.run_in_background(
+            lambda progress, cancel: planfile.apply_plan(path, folder, progress, cancel),
+            lambda result: self.finish_rename(result, incremental=False)
+        )
+    
+    def undo_rename(self):
+        """撤销最近一次重命名"""
         folder = self.folder_path.get()
         if not folder or not os.path.isdir(folder):
             messagebox.showwarning("警告", "请先选择有效文件夹")
             return
         
-        # 确认对话框
+        if journal.pending_journal(folder):
+            self.recover_rename(folder)
+            return
+        
+        if not journal.has_undo(folder):
+            messagebox.showwarning("警告", "没有可撤销的重命名")
+            return
+        
         confirm = messagebox.askyesno(
-            "确认重命名",
-            f"即将重命名 {len(items)} 个文件\n"
-            "此操作不可逆，建议先备份文件\n\n"
+            "确认撤销",
+            "将把最近一次重命名的文件恢复为原文件名\n\n"
             "确定要继续吗?"
         )
         
         if not confirm:
             return
         
-        try:
-            success_count = 0
-            failed_files = []
-            
-            for item in items:
-                original, new_name = self.preview_tree.item(item, 'values')
-                
-                try:
-                    src = os.path.join(folder, original)
-                    dst = os.path.join(folder, new_name)
-                    
-                    # 检查目标文件是否已存在
-                    if os.path.exists(dst):
-                        failed_files.append(f"{original} → {new_name} (目标文件已存在)")
-                        continue
-                    
-                    os.rename(src, dst)
-                    success_count += 1
-                except Exception as e:
-                    failed_files.append(f"{original} → {new_name} (错误: {str(e)})")
-            
-            # 显示结果
-            result_msg = f"成功重命名 {success_count} 个文件"
-            if failed_files:
-                result_msg += f"\n\n处理失败的文件:\n" + "\n".join(failed_files)
-            
-            messagebox.showinfo("重命名结果", result_msg)
-            
-            # 刷新预览
+        self.run_in_background(
+            lambda progress, cancel: journal.undo(folder, progress, cancel),
+            self.finish_rename
+        )
+    
+    def recover_rename(self, folder):
+        """处理中断的重命名：继续执行或回滚"""
+        choice = messagebox.askyesnocancel(
+            "未完成的重命名",
+            "该文件夹中有上次未完成的重命名。\n\n"
+            "是：继续执行剩余的重命名\n"
+            "否：回滚已完成的部分，恢复原文件名\n"
+            "取消：暂不处理"
+        )
+        
+        if choice is None:
+            return
+        if choice:
+            self.run_in_background(
+                lambda progress, cancel: journal.resume(folder, progress, cancel),
+                self.finish_rename
+            )
+        else:
+            # 回滚结果中没有逐个文件的改名记录，完成后重新扫描
+            self.run_in_background(
+                lambda progress, cancel: journal.rollback(folder, progress),
+                lambda result: self.finish_rename(result, incremental=False)
+            )
+    
+    def refresh_preview(self, result, recheck=False):
+        """重命名后只更新预览中受影响的行，耗时与改名数量有关而与文件夹大小无关
+
+        recheck 为真表示执行的正是当前预览的计划，未改名的行（失败或未执行）
+        逐个确认源文件是否仍然存在。预览来自其他文件夹或没有预览时重新扫描。
+        """
+        folder = self.folder_path.get()
+        if self.preview_model.transform is None or self.preview_model.folder != folder:
             self.preview_changes()
+            return
         
-        except Exception as e:
-            messagebox.showerror("错误", f"重命名过程中发生错误: {str(e)}")
+        exists = None
+        if recheck:
+            exists = lambda name: os.path.lexists(os.path.join(folder, name))
+        self.preview_model.apply_renames(result.renamed, exists)
+        self.preview_table.refresh(reset=False)
+    
+    def finish_rename(self, result, tag_report=None, incremental=True, recheck=False):
+        """重命名完成后显示结果并刷新预览，tag_report 为同时同步标题的结果
+
+        incremental 为真时按 result.renamed 增量更新预览（见 refresh_preview），
+        否则重新扫描文件夹。
+        """
+        result_msg = f"成功重命名 {result.success_count} 个文件"
+        if result.cancelled:
+            result_msg += "\n操作已取消，其余文件未重命名"
+        if result.skipped_count:
+            result_msg += f"\n跳过 {result.skipped_count} 个已过期的条目"
+        if result.failed:
+            result_msg += f"\n\n处理失败的文件:\n" + "\n".join(result.failed)
+        
+        if tag_report is not None:
+            self.show_result_dialog("重命名结果", result_msg + "\n\n【音频标题】\n" + tag_report)
+        elif instrument.enabled:
+            # 耗时统计较长，使用可滚动的对话框
+            self.show_result_dialog("重命名结果", result_msg)
+        else:
+            messagebox.showinfo("重命名结果", result_msg)
+        
+        # 刷新预览
+        if incremental:
+            self.refresh_preview(result, recheck)
+        else:
+            self.preview_changes()
 if __name__ == "__main__":
     root = tk.Tk()
     app = FileRenamerApp(root)
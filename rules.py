@@ -0,0 +1,243 @@
+"""文件名规则引擎
+
+所有识别规则（正则表达式）编译为一个组合匹配器，每个文件名只匹配一次，
+解析为结构化结果（章/节/集、编号、扩展名等），并按文件名缓存；提取、
+补齐编号、缺失检查等操作都复用同一个解析结果。重命名由一串步骤组成
+（提取、规范化、补齐、加前缀……），可在 JSON 配置文件中自定义：
+
+    {
+        "patterns": ["第(?P<number>\\\\d+)(?P<kind>[章节集])", "EP(?P<number>\\\\d+)"],
+        "steps": ["normalize", "extract", "pad:4", "prefix:三体-"]
+    }
+
+每条规则必须含有命名组 number，可选命名组 kind（章/节/集）。多条规则中
+在文件名里位置最靠前的匹配生效，位置相同时按规则顺序。
+"""
+import json
+import os
+import re
+from functools import lru_cache
+
+import numerals
+
+# 默认识别规则：第XXX章/节/集，编号可以是阿拉伯数字或中文数字
+DEFAULT_PATTERNS = (
+    rf'第(?P<number>[{numerals.CHARACTERS}\d]+)(?P<kind>[章节集])',
+)
+
+# 规则没有 kind 组时使用的类型
+DEFAULT_KIND = '集'
+
+# 每个规则集缓存的解析结果数
+CACHE_SIZE = 1 << 17
+
+GROUP_PATTERN = re.compile(r'\(\?P<(number|kind)>')
+
+
+class RuleError(ValueError):
+    """规则或步骤配置无效"""
+
+
+class Parsed:
+    """单个文件名的解析结果
+
+    stem 为不含扩展名的文件名；匹配到的部分为 stem[start:end]，其中编号位于
+    stem[number_start:number_end]。
+    """
+
+    __slots__ = ('folder', 'stem', 'ext', 'start', 'number_start', 'number_end', 'end', 'kind')
+
+    def __init__(self, folder, stem, ext, start, number_start, number_end, end, kind):
+        self.folder = folder
+        self.stem = stem
+        self.ext = ext
+        self.start = start
+        self.number_start = number_start
+        self.number_end = number_end
+        self.end = end
+        self.kind = kind
+
+    @property
+    def number_text(self):
+        """编号原文"""
+        return self.stem[self.number_start:self.number_end]
+
+    @property
+    def number(self):
+        """编号数值（阿拉伯数字或中文数字）；无法识别时为 None"""
+        return numerals.to_int(self.number_text)
+
+    @property
+    def episode(self):
+        """匹配到的部分，如“第12集”"""
+        return self.stem[self.start:self.end]
+
+    def parts(self):
+        """[匹配前, 编号前, 编号, 编号后, 匹配后]"""
+        stem = self.stem
+        return [stem[:self.start], stem[self.start:self.number_start],
+                stem[self.number_start:self.number_end],
+                stem[self.number_end:self.end], stem[self.end:]]
+
+
+class RuleSet:
+    """编译后的识别规则"""
+
+    def __init__(self, patterns=DEFAULT_PATTERNS, cache_size=CACHE_SIZE):
+        self.patterns = tuple(patterns)
+        if not self.patterns:
+            raise RuleError("至少需要一条识别规则")
+
+        alternatives = []
+        names = []
+        for index, pattern in enumerate(self.patterns):
+            try:
+                compiled = re.compile(pattern)
+            except re.error as e:
+                raise RuleError(f"无效的规则 {pattern}: {e}") from e
+            if 'number' not in compiled.groupindex:
+                raise RuleError(f"规则缺少命名组 number: {pattern}")
+            # 各规则的组名加上序号，合并为一个正则
+            renamed = GROUP_PATTERN.sub(lambda m: f'(?P<{m.group(1)}{index}>', pattern)
+            alternatives.append(f'(?P<rule{index}>{renamed})')
+            names.append((f'rule{index}', f'number{index}', f'kind{index}'))
+        try:
+            self.matcher = re.compile('|'.join(alternatives))
+        except re.error as e:
+            raise RuleError(f"规则无法合并（命名组重复？）: {e}") from e
+
+        # 规则组序号 -> (编号组序号, 类型组序号或 None)，避免逐次按组名查找
+        groups = self.matcher.groupindex
+        self.groups = {
+            groups[rule]: (groups[number], groups.get(kind))
+            for rule, number, kind in names
+        }
+        self.parse = lru_cache(maxsize=cache_size)(self.parse_uncached)
+
+    def parse_uncached(self, filename):
+        """解析文件名；没有匹配任何规则时返回 None"""
+        if os.sep in filename or (os.altsep and os.altsep in filename):
+            folder, name = os.path.split(filename)
+        else:
+            folder, name = '', filename
+        stem, ext = os.path.splitext(name)
+        match = self.matcher.search(stem)
+        if match is None:
+            return None
+
+        # 最外层的规则组最后闭合
+        number_group, kind_group = self.groups[match.lastindex]
+        number_start, number_end = match.span(number_group)
+        kind = match.group(kind_group) if kind_group is not None else None
+        start, end = match.span()
+        return Parsed(folder, stem, ext, start, number_start, number_end, end, kind or DEFAULT_KIND)
+
+
+def step_extract(parsed, parts, argument):
+    """只保留匹配到的部分"""
+    parts[0] = parts[4] = ''
+
+
+def step_normalize(parsed, parts, argument):
+    """统一写成“第X章/节/集”"""
+    parts[1] = '第'
+    parts[3] = parsed.kind
+
+
+def step_pad(parsed, parts, argument):
+    """编号补零到指定位数，中文数字和全角数字先转换为阿拉伯数字"""
+    text = parts[2]
+    if text.isascii() and text.isdigit():
+        parts[2] = text.zfill(argument)
+        return
+    number = numerals.to_int(text)
+    if number is not None:
+        parts[2] = str(number).zfill(argument)
+
+
+def step_prefix(parsed, parts, argument):
+    parts[0] = argument + parts[0]
+
+
+def step_suffix(parsed, parts, argument):
+    parts[4] = parts[4] + argument
+
+
+# 步骤名 -> (处理函数, 参数转换)
+STEPS = {
+    'extract': (step_extract, None),
+    'normalize': (step_normalize, None),
+    'pad': (step_pad, int),
+    'prefix': (step_prefix, str),
+    'suffix': (step_suffix, str),
+}
+
+
+def compile_step(spec):
+    """解析步骤，如 "extract"、"pad:4"、("prefix", "三体-")"""
+    if isinstance(spec, str):
+        name, _, argument = spec.partition(':')
+    else:
+        name, argument = spec[0], (spec[1] if len(spec) > 1 else '')
+    if name not in STEPS:
+        raise RuleError(f"未知的步骤: {name}（可用: {', '.join(STEPS)}）")
+
+    func, convert = STEPS[name]
+    if convert is None:
+        return func, None
+    if argument == '':
+        raise RuleError(f"步骤 {name} 需要参数，如 {name}:...")
+    try:
+        return func, convert(argument)
+    except ValueError as e:
+        raise RuleError(f"步骤 {name} 的参数无效: {argument}") from e
+
+
+class Pipeline:
+    """编译后的重命名步骤，只作用于匹配到规则的文件
+
+    require_number 为真时，还要求编号能解析为数值，否则文件名保持不变。
+    """
+
+    def __init__(self, rules, steps, require_number=False):
+        self.rules = rules
+        self.steps = [compile_step(spec) for spec in steps]
+        self.require_number = require_number
+
+    def transform(self, filename):
+        """返回新文件名；没有匹配时原样返回"""
+        parsed = self.rules.parse(filename)
+        if parsed is None or (self.require_number and parsed.number is None):
+            return filename
+
+        parts = parsed.parts()
+        for func, argument in self.steps:
+            func(parsed, parts, argument)
+        return os.path.join(parsed.folder, ''.join(parts) + parsed.ext)
+
+
+DEFAULT_RULES = RuleSet()
+
+
+@lru_cache(maxsize=None)
+def default_pipeline(steps, require_number=False):
+    """默认规则上的步骤组合（steps 为元组，按参数缓存，各操作共享解析结果）"""
+    return Pipeline(DEFAULT_RULES, steps, require_number)
+
+
+def load_config(path=None, steps=None):
+    """读取 JSON 规则配置，返回 Pipeline；steps 不为空时代替配置中的步骤"""
+    config = {}
+    if path:
+        try:
+            with open(path, encoding='utf-8') as f:
+                config = json.load(f)
+        except (OSError, ValueError) as e:
+            raise RuleError(f"无法读取规则配置 {path}: {e}") from e
+
+    patterns = config.get('patterns')
+    rules = RuleSet(patterns) if patterns else DEFAULT_RULES
+    steps = steps or config.get('steps')
+    if not steps:
+        raise RuleError("没有指定重命名步骤")
+    return Pipeline(rules, steps, config.get('require_number', False))
@@ -0,0 +1,350 @@
+"""音频标题同步（不依赖图形界面）"""
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from mutagen.mp4 import MP4
+from mutagen.id3 import ID3, ID3NoHeaderError, TPE1, TIT2
+from mutagen.flac import FLAC
+
+import instrument
+import tagscan
+from engine import OperationResult, iter_batches, iter_files
+
+# 支持的音频文件扩展名
+AUDIO_EXTENSIONS = {'.mp3', '.m4a', '.flac'}
+
+# 并行模式下每个工作进程一次处理的文件数
+BATCH_SIZE = 64
+
+# 文件数少于该值时默认不启用多进程（不足两批，进程池启动的开销抵消并行收益）
+PARALLEL_THRESHOLD = 2 * BATCH_SIZE
+
+# 标签需要扩容时预留的填充空间，之后修改标题可原地完成
+PADDING_RESERVE = 8 * 1024
+
+# 单个文件的写入结果
+SKIPPED = 'skipped'        # 标题已一致，未写入
+IN_PLACE = 'in_place'      # 利用已有填充空间原地更新
+REWRITTEN = 'rewritten'    # 标签区扩容，整个文件被重写
+
+
+def iter_audio_files(folder, recursive=False):
+    """逐个产出文件夹中支持的音频文件"""
+    return iter_files(folder, recursive, AUDIO_EXTENSIONS)
+
+
+def list_audio_files(folder, recursive=False):
+    """获取文件夹中支持的音频文件列表"""
+    return list(iter_audio_files(folder, recursive))
+
+
+class PaddingPolicy:
+    """mutagen 的 padding 回调：记录本次保存是否原地完成
+
+    现有填充空间够用时保持原大小，只改写标签区；不够时文件必然重写，
+    此时顺便预留 PADDING_RESERVE 字节，使以后的修改都能原地完成。
+    """
+
+    def __init__(self, reserve=PADDING_RESERVE):
+        self.reserve = reserve
+        self.in_place = None
+
+    def __call__(self, info):
+        if info.padding >= 0:
+            self.in_place = True
+            return info.padding
+
+        self.in_place = False
+        return max(self.reserve, info.get_default_padding())
+
+    @property
+    def status(self):
+        return IN_PLACE if self.in_place else REWRITTEN
+
+
+def title_matches(values, title):
+    """标签当前值是否已等于目标标题"""
+    return values is not None and list(values) == [title]
+
+
+def write_title(filepath, title, force=False):
+    """将标题写入单个音频文件的元数据
+
+    先读取当前的标题/艺术家，已与目标一致时不写入并返回 SKIPPED；
+    force 为真时总是重写。写入后返回 IN_PLACE 或 REWRITTEN，表示是否
+    需要重写整个文件。
+    """
+    ext = os.path.splitext(filepath)[1].lower()
+    padding = PaddingPolicy()
+
+    if not force:
+        # 先用只读标签头的快速扫描比较，已一致时不必让 mutagen 解析文件
+        try:
+            found = tagscan.read_tags(filepath)
+        except tagscan.TagScanError:
+            found = None
+        if found is not None and ext in tagscan.SYNCED_FIELDS and tagscan.is_synced(filepath, found, title):
+            return SKIPPED
+
+    if ext == '.mp3':
+        # MP3文件处理（使用ID3v2.4标准）
+        # 只读取ID3标签，不解析音频帧
+        try:
+            with instrument.stage('tags.read.mp3'):
+                tags = ID3(filepath)
+        except ID3NoHeaderError:
+            tags = ID3()
+
+        if not force and all(
+            tag in tags and title_matches(tags[tag].text, title) for tag in ['TIT2', 'TPE1']
+        ):
+            return SKIPPED
+
+        # 删除旧标题和艺术家标签（如果存在）
+        for tag in ['TIT2', 'TPE1']:
+            if tag in tags:
+                del tags[tag]
+
+        # 添加新标签（UTF-8编码）
+        tags.add(TIT2(encoding=3, text=title))  # 标题
+        tags.add(TPE1(encoding=3, text=title))  # 艺术家
+
+        # 强制保存为ID3v2.4
+        with instrument.stage('tags.save.mp3'):
+            tags.save(filepath, v2_version=4, padding=padding)
+
+    elif ext == '.m4a':
+        # M4A文件处理
+        with instrument.stage('tags.read.m4a'):
+            audio = MP4(filepath)
+
+        if not force and audio.tags is not None and all(
+            title_matches(audio.tags.get(key), title) for key in ["\xa9nam", "\xa9ART"]
+        ):
+            return SKIPPED
+
+        # 确保标签存在
+        if audio.tags is None:
+            audio.add_tags()
+
+        # 设置标题标签
+        audio.tags["\xa9nam"] = [title]  # 标题（注意这里是列表）
+        audio.tags["\xa9ART"] = [title]  # 艺术家（可选）
+        with instrument.stage('tags.save.m4a'):
+            audio.save(padding=padding)
+
+    elif ext == '.flac':
+        # FLAC文件处理
+        with instrument.stage('tags.read.flac'):
+            audio = FLAC(filepath)
+
+        if not force and audio.tags and title_matches(audio.tags.get("TITLE"), title):
+            return SKIPPED
+
+        # 确保标签存在
+        if not audio.tags:
+            audio.add_tags()
+
+        # 设置标题标签
+        audio.tags["TITLE"] = title
+        with instrument.stage('tags.save.flac'):
+            audio.save(padding=padding)
+
+    else:
+        raise ValueError(f"不支持的文件格式: {ext}")
+
+    return padding.status
+
+
+def read_tags(filepath):
+    """用 mutagen 读取标题和艺术家，返回值同 tagscan.read_tags"""
+    ext = os.path.splitext(filepath)[1].lower()
+    if ext == '.mp3':
+        try:
+            tags = ID3(filepath)
+        except ID3NoHeaderError:
+            return {}
+        keys = {'title': 'TIT2', 'artist': 'TPE1'}
+        return {field: list(tags[key].text) for field, key in keys.items() if key in tags}
+
+    if ext == '.m4a':
+        tags = MP4(filepath).tags
+        keys = {'title': '\xa9nam', 'artist': '\xa9ART'}
+    elif ext == '.flac':
+        tags = FLAC(filepath).tags
+        keys = {'title': 'TITLE', 'artist': 'ARTIST'}
+    else:
+        raise ValueError(f"不支持的文件格式: {ext}")
+
+    if not tags:
+        return {}
+    return {field: list(tags[key]) for field, key in keys.items() if key in tags}
+
+
+def sync_one(folder, filename, force=False, title=None):
+    """同步单个文件的标题，返回 (文件名, 写入结果, 错误详情或None)
+
+    title 默认为文件名（不含扩展名）。
+    """
+    if title is None:
+        title = os.path.splitext(os.path.basename(filename))[0]
+    try:
+        filepath = os.path.join(folder, filename)
+        with instrument.stage('tags.file' + os.path.splitext(filename)[1].lower()):
+            status = write_title(filepath, title, force)
+        return filename, status, None
+    except Exception as e:
+        # 获取更详细的错误信息
+        return filename, None, f"{type(e).__name__}: {str(e)}"
+
+
+def sync_batch(folder, filenames, force=False, profile=False):
+    """同步一批文件（可在工作进程中运行），返回 (sync_one 结果列表, 耗时统计)
+
+    profile 为真时在工作进程中开启耗时统计，随结果传回主进程合并；
+    否则统计为 None。
+    """
+    if profile:
+        instrument.enable()
+        instrument.reset()
+    outcomes = [sync_one(folder, filename, force) for filename in filenames]
+    return outcomes, instrument.snapshot() if profile else None
+
+
+def run_sequential(folder, audio_files, force):
+    """在当前进程中逐个同步，每个文件产出一批结果"""
+    for filename in audio_files:
+        yield [sync_one(folder, filename, force)]
+
+
+def collect(futures):
+    """取出已完成批次的结果，合并工作进程的耗时统计"""
+    for future in futures:
+        outcomes, stats = future.result()
+        instrument.merge(stats)
+        yield outcomes
+
+
+def run_parallel(folder, audio_files, workers, batch_size, force):
+    """用进程池并行同步，按完成顺序产出每批结果
+
+    同时提交的批次数限制为 workers 的两倍，输入为生成器时内存占用有界；
+    生成器被关闭（取消）时，尚未开始的批次会被撤销。
+    """
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        try:
+            for batch in iter_batches(audio_files, batch_size):
+                pending.add(executor.submit(sync_batch, folder, batch, force, instrument.enabled))
+                if len(pending) >= workers * 2:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    yield from collect(finished)
+
+            while pending:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                yield from collect(finished)
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def record_outcome(result, filename, status, error_detail):
+    """把 sync_one 的结果计入 OperationResult"""
+    if error_detail is not None:
+        result.add_failure(f"{filename} ({error_detail})")
+    elif status == SKIPPED:
+        result.add_skipped()
+    else:
+        result.add_success()
+        if status == REWRITTEN:
+            result.rewritten.append(filename)
+
+
+def skip_synced(audio_files, index, result):
+    """跳过索引记录为已同步且之后未变化的文件，不打开文件"""
+    for filename in audio_files:
+        if index.is_synced(filename):
+            result.add_skipped()
+        else:
+            yield filename
+
+
+def sync_audio_titles(folder, audio_files, progress=None, cancel=None,
+                      workers=1, batch_size=BATCH_SIZE, force=False, index=None):
+    """将文件名(不含扩展名)同步为音频标题，返回 OperationResult
+
+    progress 和 cancel 的用法同 journal.apply_renames；audio_files 为生成器时
+    总数未知，progress 的 total 为 None。workers 大于 1 时使用多进程并行写入，
+    每个进程一次处理 batch_size 个文件。标题已一致的文件默认跳过（只读取
+    标签头），force 为真时全部重写。index 为已刷新的 FolderIndex 时，
+    先按索引跳过未变化的文件，并在同步后记录文件状态。
+    """
+    result = OperationResult()
+    total = len(audio_files) if hasattr(audio_files, '__len__') else None
+    done = 0
+
+    if index is not None and not force:
+        audio_files = skip_synced(audio_files, index, result)
+
+    if workers > 1:
+        outcomes = run_parallel(folder, audio_files, workers, batch_size, force)
+    else:
+        outcomes = run_sequential(folder, audio_files, force)
+
+    if progress is not None:
+        progress(done, total)
+
+    try:
+        for batch in outcomes:
+            for outcome in batch:
+                record_outcome(result, *outcome)
+            done = result.success_count + result.skipped_count + len(result.failed)
+
+            if index is not None:
+                index.record_synced(filename for filename, _, error_detail in batch if error_detail is None)
+
+            if progress is not None:
+                progress(done, total)
+            if cancel is not None and cancel.is_set():
+                result.cancelled = True
+                break
+    finally:
+        outcomes.close()
+
+    return result
+
+
+def default_workers(count=None):
+    """默认并行进程数（图形界面使用）
+
+    可用环境变量 RENAME_SYNC_WORKERS 指定，否则为 CPU 核心数；文件数 count
+    少于 PARALLEL_THRESHOLD 时按顺序处理，启动进程池的开销大于并行的收益。
+    """
+    if count is not None and count < PARALLEL_THRESHOLD:
+        return 1
+    value = os.environ.get('RENAME_SYNC_WORKERS')
+    return max(1, int(value)) if value else (os.cpu_count() or 1)
+
+
+def format_sync_report(result):
+    """生成同步结果文本"""
+    result_msg = [
+        f"操作完成:",
+        f"✓ 成功处理: {result.success_count} 个文件",
+        f"  其中原地更新 {result.success_count - len(result.rewritten)} 个，整体重写 {len(result.rewritten)} 个",
+        f"○ 已是最新(跳过): {result.skipped_count} 个文件",
+        f"✗ 处理失败: {len(result.failed)} 个文件"
+    ]
+
+    if result.cancelled:
+        result_msg.append("（操作已取消，其余文件未处理）")
+
+    if result.rewritten:
+        result_msg.append("\n整体重写的文件(已预留填充空间，下次可原地更新):")
+        result_msg.extend(result.rewritten)
+
+    if result.failed:
+        result_msg.append("\n失败详情:")
+        result_msg.extend(result.failed)
+
+    return "\n".join(result_msg)
@@ -0,0 +1,294 @@
+"""只读取标签头的快速扫描
+
+不解析音频流（码率、时长、MP3 帧），只读取 ID3v2 的文本帧、FLAC 的
+VORBIS_COMMENT 块和 M4A 的 moov/udta/meta/ilst，其余块和帧直接跳过，
+每次读取的字节数有上限。用于写入前比较当前标题，以及批量检查哪些文件
+的标题与文件名不一致。不依赖 mutagen；遇到不常见的写法（不同步、压缩
+帧等）时返回 None，由调用方改用 mutagen 读取。
+"""
+import os
+import struct
+
+import instrument
+
+# 单个帧/块/条目读取的上限，超过时视为损坏
+MAX_FIELD = 1 << 20
+
+# 各格式同步标题时写入的字段（与 tags.write_title 一致）
+SYNCED_FIELDS = {
+    '.mp3': ('title', 'artist'),
+    '.m4a': ('title', 'artist'),
+    '.flac': ('title',),
+}
+
+ID3_FRAMES = {
+    b'TIT2': 'title', b'TPE1': 'artist',
+    b'TT2': 'title', b'TP1': 'artist',       # ID3v2.2
+}
+VORBIS_FIELDS = {'TITLE': 'title', 'ARTIST': 'artist'}
+MP4_ITEMS = {b'\xa9nam': 'title', b'\xa9ART': 'artist'}
+
+# 审查结果
+IN_SYNC = 'in_sync'
+OUT_OF_SYNC = 'out_of_sync'
+UNTAGGED = 'untagged'
+UNREADABLE = 'unreadable'
+
+
+class TagScanError(ValueError):
+    """标签结构损坏"""
+
+
+def read_exact(f, size):
+    if size > MAX_FIELD:
+        raise TagScanError(f"字段过大: {size} 字节")
+    data = f.read(size)
+    if len(data) != size:
+        raise TagScanError("文件意外结束")
+    return data
+
+
+def syncsafe(data):
+    """ID3v2 的 7 位编码整数"""
+    value = 0
+    for byte in data:
+        value = (value << 7) | (byte & 0x7f)
+    return value
+
+
+def decode_id3_text(data):
+    """解码 ID3 文本帧，返回值列表（v2.4 多值以 \\0 分隔）"""
+    if not data:
+        return []
+    encoding, payload = data[0], data[1:]
+    if encoding == 0:
+        text = payload.decode('latin-1')
+    elif encoding == 1:
+        text = payload.decode('utf-16')
+    elif encoding == 2:
+        text = payload.decode('utf-16-be')
+    elif encoding == 3:
+        text = payload.decode('utf-8')
+    else:
+        raise TagScanError(f"未知的文本编码: {encoding}")
+    # UTF-16 的多个值各自带有 BOM
+    return [value.lstrip('\ufeff') for value in text.rstrip('\0').split('\0')]
+
+
+def skip_id3(f):
+    """跳过文件开头的 ID3v2 标签（部分 FLAC 带有），返回是否存在"""
+    header = f.read(10)
+    if len(header) == 10 and header[:3] == b'ID3':
+        size = syncsafe(header[6:10]) + (10 if header[5] & 0x10 else 0)
+        f.seek(10 + size)
+        return True
+    f.seek(0)
+    return False
+
+
+def scan_id3(f):
+    """读取 ID3v2 文本帧；没有 ID3v2 标签时返回 {}"""
+    header = f.read(10)
+    if len(header) < 10 or header[:3] != b'ID3':
+        return {}
+    major, flags = header[3], header[5]
+    if major not in (2, 3, 4):
+        return None
+    if flags & 0x80 or (major == 2 and flags & 0x40):
+        # 不同步编码或压缩的标签
+        return None
+    end = 10 + syncsafe(header[6:10])
+
+    position = 10
+    if flags & 0x40 and major >= 3:
+        # 扩展头
+        size_data = read_exact(f, 4)
+        if major == 4:
+            position += syncsafe(size_data)
+        else:
+            position += 4 + struct.unpack('>I', size_data)[0]
+        f.seek(position)
+
+    id_size, header_size = (3, 6) if major == 2 else (4, 10)
+    found = {}
+    while position + header_size <= end:
+        frame_header = f.read(header_size)
+        if len(frame_header) < header_size or frame_header[0] == 0:
+            break   # 填充区
+        frame_id = frame_header[:id_size]
+        if major == 2:
+            size = int.from_bytes(frame_header[3:6], 'big')
+        elif major == 4:
+            size = syncsafe(frame_header[4:8])
+        else:
+            size = struct.unpack('>I', frame_header[4:8])[0]
+        position += header_size + size
+        if position > end:
+            raise TagScanError(f"ID3 帧超出标签范围: {frame_id!r}")
+
+        key = ID3_FRAMES.get(frame_id)
+        if key is None:
+            f.seek(position)
+            continue
+        if major >= 3 and frame_header[9] & (0x0f if major == 4 else 0xe0):
+            # 压缩、加密、不同步等帧
+            return None
+        try:
+            found[key] = decode_id3_text(read_exact(f, size))
+        except UnicodeDecodeError as e:
+            raise TagScanError(f"无法解码 {frame_id!r}: {e}") from e
+    return found
+
+
+def scan_flac(f):
+    """读取 FLAC 的 VORBIS_COMMENT 块；没有该块时返回 {}"""
+    skip_id3(f)
+    if f.read(4) != b'fLaC':
+        raise TagScanError("不是 FLAC 文件")
+
+    while True:
+        header = read_exact(f, 4)
+        last, block_type = header[0] & 0x80, header[0] & 0x7f
+        size = int.from_bytes(header[1:4], 'big')
+        if block_type == 4:
+            return parse_vorbis_comment(read_exact(f, size))
+        if last:
+            return {}
+        f.seek(size, os.SEEK_CUR)
+
+
+def parse_vorbis_comment(data):
+    found = {}
+    try:
+        vendor_length = struct.unpack_from('<I', data)[0]
+        offset = 4 + vendor_length
+        count = struct.unpack_from('<I', data, offset)[0]
+        offset += 4
+        for _ in range(count):
+            length = struct.unpack_from('<I', data, offset)[0]
+            offset += 4
+            comment = data[offset:offset + length].decode('utf-8')
+            offset += length
+            name, sep, value = comment.partition('=')
+            key = VORBIS_FIELDS.get(name.upper())
+            if sep and key is not None:
+                found.setdefault(key, []).append(value)
+    except (struct.error, UnicodeDecodeError) as e:
+        raise TagScanError(f"VORBIS_COMMENT 损坏: {e}") from e
+    return found
+
+
+def iter_atoms(f, start, end):
+    """逐个产出 [start, end) 范围内的 (类型, 数据起点, 数据终点)"""
+    position = start
+    while position + 8 <= end:
+        f.seek(position)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, kind = struct.unpack('>I4s', header)
+        data_start = position + 8
+        if size == 1:
+            size = struct.unpack('>Q', read_exact(f, 8))[0]
+            data_start += 8
+        elif size == 0:
+            size = end - position
+        if size < data_start - position or position + size > end:
+            raise TagScanError(f"atom 大小无效: {kind!r}")
+        yield kind, data_start, position + size
+        position += size
+
+
+def find_atom(f, path, start, end):
+    """按路径查找嵌套 atom，返回 (数据起点, 数据终点) 或 None"""
+    for name in path:
+        for kind, data_start, data_end in iter_atoms(f, start, end):
+            if kind == name:
+                start, end = data_start, data_end
+                if name == b'meta':
+                    start += 4      # meta 是带版本号的 full atom
+                break
+        else:
+            return None
+    return start, end
+
+
+def scan_mp4(f):
+    """读取 M4A 的 ilst 条目；没有 ilst 时返回 {}"""
+    end = f.seek(0, os.SEEK_END)
+    span = find_atom(f, (b'moov', b'udta', b'meta', b'ilst'), 0, end)
+    if span is None:
+        return {}
+
+    found = {}
+    for kind, item_start, item_end in iter_atoms(f, *span):
+        key = MP4_ITEMS.get(kind)
+        if key is None:
+            continue
+        values = []
+        for data_kind, data_start, data_end in iter_atoms(f, item_start, item_end):
+            if data_kind != b'data':
+                continue
+            f.seek(data_start)
+            payload = read_exact(f, data_end - data_start)
+            try:
+                values.append(payload[8:].decode('utf-8'))    # 跳过类型和语言
+            except UnicodeDecodeError as e:
+                raise TagScanError(f"无法解码 {kind!r}: {e}") from e
+        found[key] = values
+    return found
+
+
+SCANNERS = {'.mp3': scan_id3, '.flac': scan_flac, '.m4a': scan_mp4}
+
+
+def read_tags(filepath):
+    """读取标题和艺术家，返回 {'title': [...], 'artist': [...]}（缺少的字段不出现）
+
+    不支持的格式或需要 mutagen 处理的写法返回 None；结构损坏时抛出 TagScanError。
+    """
+    ext = os.path.splitext(filepath)[1].lower()
+    scanner = SCANNERS.get(ext)
+    if scanner is None:
+        return None
+    with instrument.stage('tags.scan' + ext), open(filepath, 'rb') as f:
+        return scanner(f)
+
+
+def is_synced(filepath, found, title):
+    """标签中需要同步的字段是否都已等于 title"""
+    fields = SYNCED_FIELDS[os.path.splitext(filepath)[1].lower()]
+    return all(found.get(field) == [title] for field in fields)
+
+
+def audit(folder, audio_files, fallback=None):
+    """检查标题是否与文件名一致，逐个产出 (文件名, 状态, 当前标题或错误详情)
+
+    fallback 为 mutagen 读取函数（如 tags.read_tags），快速扫描无法处理时使用。
+    """
+    for filename in audio_files:
+        filepath = os.path.join(folder, filename)
+        title = os.path.splitext(os.path.basename(filename))[0]
+        try:
+            try:
+                found = read_tags(filepath)
+            except TagScanError:
+                # 快速扫描读不懂的标签（如大小不是同步安全整数的 ID3v2.4 帧）交给 mutagen
+                if fallback is None:
+                    raise
+                found = None
+            if found is None and fallback is not None:
+                found = fallback(filepath)
+        except Exception as e:
+            yield filename, UNREADABLE, f"{type(e).__name__}: {str(e)}"
+            continue
+
+        if found is None:
+            yield filename, UNREADABLE, "需要 mutagen 读取"
+        elif not found:
+            yield filename, UNTAGGED, None
+        elif is_synced(filepath, found, title):
+            yield filename, IN_SYNC, None
+        else:
+            current = found.get('title')
+            yield filename, OUT_OF_SYNC, " / ".join(current) if current else None
@@ -0,0 +1,315 @@
+"""监视模式
+
+监视文件夹中新下载或有变化的文件，等文件写完（大小和修改时间在一段时间
+内不再变化）后，只对这些文件提取章节信息、补齐编号并同步音频标题。
+Linux 上使用 inotify，空闲时阻塞等待事件；其他平台退化为定时扫描。
+
+本进程改名和写入标题产生的事件会被忽略，不会重复处理自己的输出；一次
+监视中各批重命名的撤销信息保存在一起，undo 可撤销整个监视期间的改名。
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+
+import engine
+import journal
+import normalize
+import rules
+
+# 下载工具使用的临时文件后缀，改为正式文件名后再处理
+PARTIAL_SUFFIXES = ('.part', '.crdownload', '.download', '.tmp', '.!qb', '.aria2')
+
+# inotify 事件
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+EVENT_HEADER = struct.Struct('iIII')
+
+# 本进程产生的文件在该时间（秒）内再次触发事件且未再变化时，视为自己的输出
+OWN_CHANGE_WINDOW = 60.0
+
+
+def is_candidate(name):
+    """是否需要处理的文件名"""
+    return not name.startswith(engine.RESERVED_PREFIX) and not name.lower().endswith(PARTIAL_SUFFIXES)
+
+
+def file_signature(path):
+    """文件的大小和修改时间；文件已不存在时返回 None"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def list_names(folder):
+    """文件夹中的文件名（不含子文件夹）"""
+    with os.scandir(folder) as entries:
+        return [entry.name for entry in entries if entry.is_file()]
+
+
+class InotifyWatcher:
+    """基于 inotify 的监视器（仅 Linux）"""
+
+    def __init__(self, folders):
+        libc_name = ctypes.util.find_library('c')
+        if sys.platform != 'linux' or not libc_name:
+            raise OSError("inotify 不可用")
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 失败")
+
+        self.folders = {}
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+        for folder in folders:
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(folder), mask)
+            if wd < 0:
+                self.close()
+                raise OSError(ctypes.get_errno(), f"无法监视 {folder}")
+            self.folders[wd] = folder
+
+    def wait(self, timeout):
+        """等待事件，返回 [(文件夹, 文件名), ...]；timeout 为 None 时一直等待"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+
+        changes = []
+        overflowed = False
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    overflowed = True
+                elif wd in self.folders and name and not mask & IN_ISDIR:
+                    changes.append((self.folders[wd], os.fsdecode(name)))
+
+        if overflowed:
+            # 事件队列溢出，部分事件已丢失：把所有文件都当作有变化
+            for folder in self.folders.values():
+                try:
+                    changes.extend((folder, name) for name in list_names(folder))
+                except OSError:
+                    continue
+        return changes
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """定时扫描的监视器，用于不支持 inotify 的平台或网络文件系统"""
+
+    def __init__(self, folders, interval=2.0):
+        self.interval = interval
+        self.snapshots = {folder: self.snapshot(folder) for folder in folders}
+
+    def snapshot(self, folder):
+        """文件名 -> (大小, 修改时间)"""
+        result = {}
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    stat = entry.stat()
+                    result[entry.name] = (stat.st_size, stat.st_mtime_ns)
+        return result
+
+    def wait(self, timeout):
+        time.sleep(self.interval if timeout is None else min(timeout, self.interval))
+
+        changes = []
+        for folder, previous in self.snapshots.items():
+            current = self.snapshot(folder)
+            for name, signature in current.items():
+                if previous.get(name) != signature:
+                    changes.append((folder, name))
+            self.snapshots[folder] = current
+        return changes
+
+    def close(self):
+        pass
+
+
+def create_watcher(folders, poll=False, interval=2.0):
+    """优先使用 inotify，不可用时使用定时扫描"""
+    if not poll:
+        try:
+            return InotifyWatcher(folders)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(folders, interval)
+
+
+class OwnChanges:
+    """记录本进程刚改名或写入标题的文件，忽略它们随后触发的事件"""
+
+    def __init__(self, window=OWN_CHANGE_WINDOW):
+        self.window = window
+        self.entries = {}   # (文件夹, 文件名) -> (过期时间, 文件签名)，按记录时间排列
+
+    def add(self, folder, names, now):
+        for name in names:
+            signature = file_signature(os.path.join(folder, name))
+            self.entries.pop((folder, name), None)
+            if signature is not None:
+                self.entries[(folder, name)] = (now + self.window, signature)
+
+    def is_own(self, folder, name, now):
+        """事件是否由本进程产生：文件在记录之后没有再变化"""
+        while self.entries:
+            key = next(iter(self.entries))
+            if self.entries[key][0] > now:
+                break
+            del self.entries[key]
+        entry = self.entries.get((folder, name))
+        return entry is not None and file_signature(os.path.join(folder, name)) == entry[1]
+
+
+class Debouncer:
+    """等待文件写完：事件后 settle 秒内大小和修改时间都未变化才算就绪"""
+
+    def __init__(self, settle=5.0):
+        self.settle = settle
+        self.pending = {}   # (文件夹, 文件名) -> [截止时间, 文件签名]
+
+    def touch(self, folder, name, now):
+        signature = file_signature(os.path.join(folder, name))
+        if signature is None:
+            self.pending.pop((folder, name), None)
+        else:
+            self.pending[(folder, name)] = [now + self.settle, signature]
+
+    def timeout(self, now):
+        """距离下一次检查的秒数；没有待处理文件时返回 None（一直等待）"""
+        if not self.pending:
+            return None
+        return max(0.0, min(deadline for deadline, _ in self.pending.values()) - now)
+
+    def ready(self, now):
+        """取出已写完的文件，按文件夹分组"""
+        ready = {}
+        for key, entry in list(self.pending.items()):
+            deadline, signature = entry
+            if deadline > now:
+                continue
+            current = file_signature(os.path.join(*key))
+            if current is None:
+                del self.pending[key]
+            elif current == signature:
+                del self.pending[key]
+                ready.setdefault(key[0], []).append(key[1])
+            else:
+                # 仍在写入，继续等待
+                entry[0] = now + self.settle
+                entry[1] = current
+        return ready
+
+
+def normalize_name(name, width):
+    """提取章节信息并补齐编号"""
+    return rules.default_pipeline(('extract', ('pad', width))).transform(name)
+
+
+def process_files(folder, names, width=engine.NUMBER_WIDTH, sync_tags=True, log=print, append_undo=False):
+    """重命名并同步标题，只处理给定的文件
+
+    append_undo 的用法同 journal.apply_renames。返回 (重命名结果, 本次产生的
+    文件名)，文件夹有未完成的重命名时重命名结果为 None。
+    """
+    plan = []
+    unchanged = []
+    for name in names:
+        new_name = normalize_name(name, width)
+        if new_name != name:
+            plan.append((name, new_name))
+        else:
+            unchanged.append(name)
+
+    tags = None
+    if sync_tags:
+        try:
+            import tags
+        except ImportError as e:
+            log(f"音频标题同步需要安装mutagen库，已跳过 ({e})")
+
+    audio_files = []
+    try:
+        if tags is None:
+            result, tag_result = journal.apply_renames(folder, plan, append_undo=append_undo), None
+        else:
+            # 改名和写标题一次完成
+            audio_files = [
+                name for name in unchanged
+                if os.path.splitext(name)[1].lower() in tags.AUDIO_EXTENSIONS
+            ]
+            result, tag_result = normalize.rename_and_tag(folder, plan, audio_files, append_undo=append_undo)
+    except journal.JournalError as e:
+        log(f"[{folder}] {e}")
+        return None, []
+
+    for src, dst in result.renamed:
+        log(f"[{folder}] {src} → {dst}")
+    for detail in result.failed:
+        log(f"[{folder}] ✗ {detail}")
+    if tag_result is not None:
+        if tag_result.success_count:
+            log(f"[{folder}] 同步音频标题 {tag_result.success_count} 个")
+        for detail in tag_result.failed:
+            log(f"[{folder}] ✗ {detail}")
+    return result, [dst for _, dst in result.renamed] + audio_files
+
+
+def watch(folders, settle=5.0, poll=False, interval=2.0, width=engine.NUMBER_WIDTH,
+          sync_tags=True, log=print, stop=None):
+    """持续监视文件夹，直到 stop（threading.Event）被设置或被中断"""
+    for folder in folders:
+        if not os.path.isdir(folder):
+            raise NotADirectoryError(folder)
+
+    watcher = create_watcher(folders, poll, interval)
+    debouncer = Debouncer(settle)
+    own_changes = OwnChanges()
+    undo_folders = set()    # 本次监视中已保存撤销信息的文件夹，之后的批次追加在后面
+    log(f"正在监视 {len(folders)} 个文件夹（{type(watcher).__name__}），按 Ctrl+C 退出")
+
+    try:
+        while stop is None or not stop.is_set():
+            timeout = debouncer.timeout(time.monotonic())
+            if stop is not None:
+                # 需要定期检查停止标志
+                timeout = 1.0 if timeout is None else min(timeout, 1.0)
+
+            for folder, name in watcher.wait(timeout):
+                now = time.monotonic()
+                if is_candidate(name) and not own_changes.is_own(folder, name, now):
+                    debouncer.touch(folder, name, now)
+
+            for folder, names in debouncer.ready(time.monotonic()).items():
+                result, produced = process_files(
+                    folder, sorted(names), width, sync_tags, log, folder in undo_folders
+                )
+                if result is not None and result.renamed:
+                    undo_folders.add(folder)
+                own_changes.add(folder, produced, time.monotonic())
+    finally:
+        watcher.close()
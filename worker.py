@@ -0,0 +1,107 @@
+"""后台任务
+
+耗时操作在工作线程中执行，进度通过队列传回，由 Tk 事件循环定时读取，
+主界面在操作期间保持响应，并可随时取消。
+"""
+import queue
+import threading
+import time
+
+
+class Progress:
+    """进度信息：已完成数量、总数、吞吐量和预计剩余时间"""
+
+    def __init__(self, done, total, elapsed):
+        self.done = done
+        self.total = total
+        self.elapsed = elapsed
+
+    @property
+    def rate(self):
+        """每秒处理的文件数"""
+        return self.done / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def eta(self):
+        """预计剩余秒数，无法估计时返回 None"""
+        if not self.total or not self.rate:
+            return None
+        return (self.total - self.done) / self.rate
+
+    def describe(self):
+        """进度文本"""
+        text = f"{self.done}/{self.total or '?'}  {self.rate:.1f} 个/秒"
+        if self.eta is not None:
+            text += f"  剩余约 {int(self.eta)} 秒"
+        return text
+
+
+class BackgroundTask:
+    """在工作线程中运行 target(progress, cancel)
+
+    progress(done, total) 可在工作线程中随时调用；cancel 为 threading.Event，
+    target 应在处理每个文件前检查。on_progress(Progress) 和
+    on_done(result, error) 都在 Tk 主线程中回调。
+    """
+
+    def __init__(self, root, target, on_progress=None, on_done=None, poll_ms=100):
+        self.root = root
+        self.target = target
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.poll_ms = poll_ms
+        self.cancel_event = threading.Event()
+        self.events = queue.Queue()
+        self.thread = None
+        self.started = None
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self):
+        self.started = time.monotonic()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        self.root.after(self.poll_ms, self.poll)
+
+    def cancel(self):
+        """请求取消，当前文件处理完后停止"""
+        self.cancel_event.set()
+
+    def report(self, done, total=None):
+        """供工作线程调用的进度回调"""
+        self.events.put(('progress', (done, total)))
+
+    def run(self):
+        try:
+            result = self.target(self.report, self.cancel_event)
+        except Exception as e:
+            self.events.put(('done', (None, e)))
+        else:
+            self.events.put(('done', (result, None)))
+
+    def poll(self):
+        """在主线程中读取队列，只处理最新的进度"""
+        latest = None
+        finished = None
+        while True:
+            try:
+                kind, payload = self.events.get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'progress':
+                latest = payload
+            else:
+                finished = payload
+
+        if latest is not None and self.on_progress:
+            done, total = latest
+            self.on_progress(Progress(done, total, time.monotonic() - self.started))
+
+        if finished is not None:
+            if self.on_done:
+                self.on_done(*finished)
+            return
+
+        self.root.after(self.poll_ms, self.poll)